@@ -0,0 +1,77 @@
+import asyncio
+import datetime
+import json
+import random
+from typing import Optional, Tuple
+
+from aiohttp import web
+
+import local_nlp
+
+
+# Local stand-in for api.wit.ai's /message endpoint, with injectable latency and errors.
+# Messages that local_nlp understands get the equivalent answer, and anything else is answered as if it said "8pm".
+# Errors are either random (error_rate) or scripted with fail_next(), and can carry a Retry-After header.
+class FakeWitServer:
+  def __init__(self, latency: float = 0.0, jitter: float = 0.0, host: str = '127.0.0.1', port: int = 0,
+      error_rate: float = 0.0, error_status: int = 503, retry_after: Optional[float] = None):
+    self.latency = latency
+    self.jitter = jitter
+    self.host = host
+    self.port = port
+    self.error_rate = error_rate
+    self.error_status = error_status
+    self.retry_after = retry_after
+    self.requests = 0
+    self.errors = 0
+    self._scripted_errors = []
+    self._runner = None
+
+  def fail_next(self, count: int, status: int = 503, retry_after: Optional[float] = None):
+    self._scripted_errors.extend([(status, retry_after)] * count)
+
+  def _next_error(self) -> Optional[Tuple[int, Optional[float]]]:
+    if self._scripted_errors:
+      return self._scripted_errors.pop(0)
+    if self.error_rate and random.random() < self.error_rate:
+      return (self.error_status, self.retry_after)
+    return None
+
+  @property
+  def url(self) -> str:
+    return f'http://{self.host}:{self.port}/message'
+
+  async def handle_message(self, request: web.Request) -> web.Response:
+    self.requests += 1
+    delay = self.latency + random.uniform(0, self.jitter)
+    if delay > 0:
+      await asyncio.sleep(delay)
+    error = self._next_error()
+    if error:
+      self.errors += 1
+      (status, retry_after) = error
+      headers = {'Retry-After': f'{retry_after:g}'} if retry_after is not None else None
+      return web.json_response({'error': 'Injected error', 'code': status}, status=status, headers=headers)
+    query = request.query.get('q', '')
+    context = json.loads(request.query.get('context', '{}'))
+    reference_time = datetime.datetime.fromisoformat(context['reference_time'])
+    doc = local_nlp._parse(query, reference_time) or local_nlp._parse('8pm', reference_time)
+    for entity in doc['entities'][local_nlp.ENT_DATETIME_KEY]:
+      entity['body'] = query
+    doc['text'] = query
+    return web.json_response(doc)
+
+  async def start(self):
+    app = web.Application()
+    app.router.add_get('/message', self.handle_message)
+    self._runner = web.AppRunner(app, access_log=None)
+    await self._runner.setup()
+    site = web.TCPSite(self._runner, self.host, self.port)
+    await site.start()
+    # Pick up the actual port when binding to port 0
+    self.port = site._server.sockets[0].getsockname()[1]
+
+  async def close(self):
+    if self._runner:
+      await self._runner.cleanup()
+      self._runner = None
@@ -0,0 +1,72 @@
+import datetime
+import itertools
+from typing import List, Optional
+
+# Minimal stand-ins for the discord.py models that discord_bot's handlers use, so that they can be driven without a gateway.
+
+_ids = itertools.count(1_000_000_000_000_000_000)
+
+
+class FakeAsset:
+  def __init__(self, url: str):
+    self.url = url
+
+
+class FakeUser:
+  def __init__(self, name: str, bot: bool = False, id: Optional[int] = None):
+    self.id = id if id is not None else next(_ids)
+    self.bot = bot
+    self.name = name
+    self.display_name = name
+    self.avatar = FakeAsset(f'https://cdn.example.com/avatars/{self.id}.png')
+    self.display_avatar = self.avatar
+    self.mention = f'<@{self.id}>'
+
+
+class FakePermissions:
+  manage_messages = False
+  read_messages = True
+
+
+class FakeChannel:
+  def __init__(self, guild: 'FakeGuild', members: List[FakeUser]):
+    self.id = next(_ids)
+    self.name = f'channel-{self.id}'
+    self.guild = guild
+    self.members = members
+
+  def permissions_for(self, member) -> FakePermissions:
+    return FakePermissions()
+
+
+class FakeGuild:
+  def __init__(self, members: List[FakeUser], me: FakeUser):
+    self.id = next(_ids)
+    self.name = f'guild-{self.id}'
+    self.members = members
+    self.me = me
+    self.channel = FakeChannel(self, members)
+
+  async def chunk(self, cache: bool = True) -> List[FakeUser]:
+    return self.members
+
+
+class FakeMessage:
+  def __init__(self, content: str, author: FakeUser, guild: FakeGuild, created_at: datetime.datetime, mentions: Optional[List[FakeUser]] = None):
+    self.id = next(_ids)
+    self.content = content
+    self.author = author
+    self.guild = guild
+    self.channel = guild.channel
+    self.created_at = created_at
+    self.reference = None
+    self.mentions = mentions or []
+    self.replies = []
+
+  async def reply(self, content=None, **kwargs):
+    reply = FakeMessage(content or '', self.guild.me, self.guild, self.created_at)
+    self.replies.append((content, kwargs))
+    return reply
+
+  async def pin(self):
+    pass
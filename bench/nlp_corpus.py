@@ -0,0 +1,83 @@
+import argparse
+import datetime
+import json
+import logging as pyLogging
+import os
+import time
+import tracemalloc
+
+import dateutil.tz
+
+import nlp
+
+# Micro-benchmark for the conversion step of nlp.process_time_message, run from the repository root with:
+#   python -m bench.nlp_corpus
+# Recorded Wit responses are fed straight into nlp.convert_doc, without any network, and the number of conversions
+# per second and the memory allocated per conversion are reported.
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'corpus', 'wit_responses.json')
+VALID_GRAINS = {
+  'datetime': nlp.ENT_GRAIN_DATETIME,
+  'date': nlp.ENT_GRAIN_DATE,
+}
+
+
+def load_corpus(path: str):
+  with open(path) as f:
+    entries = json.load(f)
+  corpus = []
+  for entry in entries:
+    tz = dateutil.tz.gettz(entry['timezone'])
+    reference_time = datetime.datetime.fromisoformat(entry['reference_time']).astimezone(tz)
+    corpus.append((entry['text'], entry['response'], reference_time, VALID_GRAINS[entry['valid_grains']]))
+  return corpus
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark nlp.convert_doc against recorded Wit responses.')
+  parser.add_argument('--corpus', default=CORPUS_PATH, help='path to the recorded responses (default: %(default)s)')
+  parser.add_argument('--iterations', type=int, default=2000, help='number of passes over the corpus (default: %(default)s)')
+  parser.add_argument('--show', action='store_true', help='print the converted result for each recorded response')
+  args = parser.parse_args()
+
+  corpus = load_corpus(args.corpus)
+  # Some recorded responses have no usable values on purpose, which nlp logs as errors
+  pyLogging.getLogger('soupbot.nlp').setLevel(pyLogging.CRITICAL)
+  if args.show:
+    for (text, doc, reference_time, valid_grains) in corpus:
+      print(f'{text!r}: {nlp.convert_doc(doc, reference_time, valid_grains)}')
+
+  # Warm up
+  for (_, doc, reference_time, valid_grains) in corpus:
+    nlp.convert_doc(doc, reference_time, valid_grains)
+
+  t0 = time.perf_counter()
+  for _ in range(args.iterations):
+    for (_, doc, reference_time, valid_grains) in corpus:
+      nlp.convert_doc(doc, reference_time, valid_grains)
+  elapsed = time.perf_counter() - t0
+  parses = args.iterations * len(corpus)
+
+  # Allocations are measured separately, since tracing slows everything down
+  tracemalloc.start()
+  peaks = []
+  for (_, doc, reference_time, valid_grains) in corpus:
+    baseline = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    nlp.convert_doc(doc, reference_time, valid_grains)
+    peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+  results = []
+  before = tracemalloc.take_snapshot()
+  for (_, doc, reference_time, valid_grains) in corpus:
+    results.append(nlp.convert_doc(doc, reference_time, valid_grains))
+  after = tracemalloc.take_snapshot()
+  tracemalloc.stop()
+  retained = [stat for stat in after.compare_to(before, 'filename') if stat.size_diff > 0]
+  retained_blocks = sum(stat.count_diff for stat in retained)
+  retained_bytes = sum(stat.size_diff for stat in retained)
+
+  print(f'{parses} conversions of {len(corpus)} recorded responses in {elapsed:.3f}s')
+  print(f'{parses / elapsed:,.0f} parses/s ({elapsed / parses * 1e6:.2f} us/parse)')
+  print(f'{sum(peaks) / len(peaks) / 1024:.2f} KiB peak allocated per parse, {retained_blocks / len(corpus):.1f} blocks ({retained_bytes / len(corpus):.0f} bytes) retained per result')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import datetime
+import logging as pyLogging
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+import dateutil.tz
+
+import db_async
+import discord_bot
+import env
+import nlp
+from bench.fake_wit import FakeWitServer
+from bench.fakes import FakeGuild, FakeMessage, FakeUser
+
+# End-to-end replay benchmark for discord_bot's on_message handler, run from the repository root with:
+#   python -m bench.on_message --messages 5000 --wit-latency 0.15
+# Messages are replayed against a temporary SQLite database and a local fake Wit server, and latency percentiles and
+# throughput are reported for each command.
+
+COMMANDS = {
+  'time': ['$time at 9pm', '$time tomorrow at 3pm', '$time friday 3-5pm', '$time lets do it around 8 tonight'],
+  'dinkdonk': ['$dinkdonk'],
+  'mydinkdonks': ['$mydinkdonks'],
+  'whoisavailable': ['$whoisavailable tomorrow', '$whoisavailable on friday', '$whoisavailable some day next week'],
+  'chatter': ['lol', 'anyone up for soup tonight?', 'brb', 'that was a great game yesterday, gg everyone'],
+}
+DEFAULT_MIX = 'time=4,dinkdonk=2,mydinkdonks=1,whoisavailable=1,chatter=12'
+TIMEZONES = ['America/Los_Angeles', 'America/New_York', 'Europe/London', 'Asia/Tokyo']
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+  weights = {}
+  for part in mix.split(','):
+    (name, weight) = part.split('=')
+    if name not in COMMANDS:
+      raise ValueError(f'Unknown command "{name}" in mix; expected one of {", ".join(COMMANDS)}')
+    weights[name] = float(weight)
+  return weights
+
+def percentile(sorted_values: List[float], p: float) -> float:
+  if not sorted_values:
+    return 0.0
+  return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+async def bench(args):
+  fake_wit = FakeWitServer(latency=args.wit_latency, jitter=args.wit_jitter, error_rate=args.wit_error_rate, error_status=args.wit_error_status,
+    retry_after=args.wit_retry_after)
+  await fake_wit.start()
+  with tempfile.TemporaryDirectory() as tmp:
+    env.DISCORD_TOKEN = 'bench'
+    env.WIT_TOKEN = 'bench'
+    env.WIT_URL = fake_wit.url
+    env.DB_PATH = os.path.join(tmp, 'bench.db')
+    env.LOCAL_NLP = args.local_nlp
+    env.DB_WRITE_BEHIND = args.write_behind
+    env.MEMBER_CACHE = args.member_cache
+    env.TRACE = args.trace
+    env.TRACE_SLOW_MS = args.trace_slow_ms
+    if args.trace:
+      pyLogging.basicConfig(format='%(name)s: %(message)s')
+      pyLogging.getLogger('soupbot.tracing').setLevel(pyLogging.INFO)
+    db_async.init()
+    nlp.init()
+    await nlp.start()
+
+    client = discord_bot.create_client()
+    bot_user = FakeUser('SoupBot', bot=True)
+    client._connection.user = bot_user
+    users = [FakeUser(f'user{i}') for i in range(args.users)]
+    guilds = [FakeGuild(users, bot_user) for _ in range(args.guilds)]
+    channels = {guild.channel.id: guild.channel for guild in guilds}
+    client.get_channel = lambda id: channels.get(id)
+    for (i, user) in enumerate(users):
+      await db_async.set_timezone_for_user_id(user.id, TIMEZONES[i % len(TIMEZONES)])
+
+    rng = random.Random(args.seed)
+    weights = parse_mix(args.mix)
+    names = list(weights)
+    start_time = datetime.datetime(2024, 5, 1, 12, tzinfo=dateutil.tz.tzutc())
+    messages = []
+    for i in range(args.messages):
+      name = rng.choices(names, weights=[weights[n] for n in names])[0]
+      content = rng.choice(COMMANDS[name])
+      # Spread messages over time, so that $dinkdonk isn't always on cooldown
+      created_at = start_time + datetime.timedelta(minutes=i)
+      messages.append((name, FakeMessage(content, rng.choice(users), rng.choice(guilds), created_at)))
+
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    queue = asyncio.Queue()
+    for item in messages:
+      queue.put_nowait(item)
+
+    async def worker():
+      while not queue.empty():
+        (name, message) = queue.get_nowait()
+        t0 = time.perf_counter()
+        await client.on_message(message)
+        latencies[name].append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - t0
+
+    print(f'{args.messages} messages in {elapsed:.2f}s ({args.messages / elapsed:.1f} msg/s), concurrency {args.concurrency}, Wit latency {args.wit_latency * 1000:.0f}ms, {fake_wit.requests} Wit requests ({fake_wit.errors} failed)')
+    print(f'{"command":<16}{"count":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"msg/s":>10}')
+    for name in names:
+      values = sorted(latencies[name])
+      if not values:
+        continue
+      # Throughput over the whole run, so that the per-command rates add up to the overall one
+      print(f'{name:<16}{len(values):>8}{percentile(values, 50) * 1000:>10.2f}{percentile(values, 95) * 1000:>10.2f}{percentile(values, 99) * 1000:>10.2f}{len(values) / elapsed:>10.1f}')
+
+    await nlp.close()
+    await db_async.close()
+  await fake_wit.close()
+
+def main():
+  parser = argparse.ArgumentParser(description='Replay synthetic traffic through discord_bot\'s on_message handler.')
+  parser.add_argument('--messages', type=int, default=2000, help='number of messages to replay (default: %(default)s)')
+  parser.add_argument('--mix', default=DEFAULT_MIX, help='relative weights of each command (default: %(default)s)')
+  parser.add_argument('--concurrency', type=int, default=8, help='number of messages handled concurrently (default: %(default)s)')
+  parser.add_argument('--guilds', type=int, default=20, help='number of synthetic guilds (default: %(default)s)')
+  parser.add_argument('--users', type=int, default=200, help='number of synthetic users (default: %(default)s)')
+  parser.add_argument('--wit-latency', type=float, default=0.1, help='fake Wit response latency in seconds (default: %(default)s)')
+  parser.add_argument('--wit-jitter', type=float, default=0.05, help='random extra fake Wit latency in seconds (default: %(default)s)')
+  parser.add_argument('--wit-error-rate', type=float, default=0.0, help='fraction of fake Wit requests that fail (default: %(default)s)')
+  parser.add_argument('--wit-error-status', type=int, default=503, help='HTTP status of failed fake Wit requests (default: %(default)s)')
+  parser.add_argument('--wit-retry-after', type=float, help='Retry-After header of failed fake Wit requests, in seconds (default: none)')
+  parser.add_argument('--local-nlp', action=argparse.BooleanOptionalAction, default=True, help='enable the local time parser (default: %(default)s)')
+  parser.add_argument('--write-behind', action=argparse.BooleanOptionalAction, default=False, help='enable write-behind DB mode (default: %(default)s)')
+  parser.add_argument('--member-cache', default='all', help='member cache policy, as in SOUPBOT_MEMBER_CACHE (default: %(default)s)')
+  parser.add_argument('--trace', action=argparse.BooleanOptionalAction, default=False, help='enable stage tracing (default: %(default)s)')
+  parser.add_argument('--trace-slow-ms', type=float, default=float('inf'), help='log traces of commands slower than this (default: don\'t log)')
+  parser.add_argument('--seed', type=int, default=0, help='random seed for the message mix (default: %(default)s)')
+  asyncio.run(bench(parser.parse_args()))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,55 @@
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+  """Fails fast after too many consecutive failures, then lets a single trial call through once reset_timeout has passed."""
+
+  def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self.state = CLOSED
+    self.failures = 0
+    self._opened_at = 0.0
+    self._trial_started_at = None
+    self.stats = {'opened': 0, 'rejected': 0}
+
+  def allow(self) -> bool:
+    if self.state == CLOSED:
+      return True
+    now = time.monotonic()
+    if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+      self.state = HALF_OPEN
+      self._trial_started_at = None
+    # A trial that never reported back (e.g. it was cancelled) doesn't block new ones forever
+    if self.state == HALF_OPEN and (self._trial_started_at is None or now - self._trial_started_at >= self.reset_timeout):
+      self._trial_started_at = now
+      return True
+    self.stats['rejected'] += 1
+    return False
+
+  def retry_in(self) -> float:
+    if self.state != OPEN:
+      return 0.0
+    return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+  def record_success(self):
+    self.state = CLOSED
+    self.failures = 0
+    self._trial_started_at = None
+
+  # Ends a call without an outcome, e.g. when it was cancelled before reaching the service
+  def release(self):
+    self._trial_started_at = None
+
+  def record_failure(self):
+    self.failures += 1
+    if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+      if self.state != OPEN:
+        self.stats['opened'] += 1
+      self.state = OPEN
+      self._opened_at = time.monotonic()
+      self._trial_started_at = None
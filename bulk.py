@@ -0,0 +1,179 @@
+import argparse
+import csv
+import json
+import logging as pyLogging
+import os
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, TextIO
+
+import db
+
+logging = pyLogging.getLogger('soupbot.bulk')
+
+# Exported and imported columns of each table with their types, and the columns of their primary key
+TABLES = {
+  'users': {
+    'columns': {'id': int, 'tz': str, 'last_modified': int},
+    'key': ('id',),
+  },
+  'dinkdonk': {
+    'columns': {'server_id': int, 'user_id': int, 'count': int, 'lifetime_count': int, 'should_alert': int, 'last_modified': int},
+    'key': ('server_id', 'user_id'),
+  },
+  'cross_dinkdonks': {
+    'columns': {'server_id': int, 'to_user_id': int, 'from_user_id': int, 'count': int, 'last_modified': int},
+    'key': ('server_id', 'to_user_id', 'from_user_id'),
+  },
+  'availability': {
+    'columns': {'server_id': int, 'user_id': int, 'on_date': str, 'is_available': int, 'description': str, 'last_modified': int},
+    'key': ('server_id', 'user_id', 'on_date'),
+  },
+}
+FORMATS = ('jsonl', 'csv')
+
+
+class Progress:
+  """Logs the number of rows processed and the rate, every few seconds and once done."""
+
+  def __init__(self, action: str, table: str, interval: float = 5.0):
+    self.action = action
+    self.table = table
+    self.interval = interval
+    self.rows = 0
+    self.start = time.perf_counter()
+    self._last_report = self.start
+
+  def add(self, rows: int):
+    self.rows += rows
+    now = time.perf_counter()
+    if now - self._last_report >= self.interval:
+      self._last_report = now
+      self._log('%s %d rows of "%s" so far (%.0f rows/s)', now)
+
+  def done(self):
+    self._log('%s %d rows of "%s" in %.2fs (%.0f rows/s)', time.perf_counter(), total=True)
+
+  def _log(self, message: str, now: float, total: bool = False):
+    elapsed = now - self.start
+    rate = self.rows / elapsed if elapsed > 0 else 0.0
+    if total:
+      logging.info(message, self.action, self.rows, self.table, elapsed, rate)
+    else:
+      logging.info(message, self.action, self.rows, self.table, rate)
+
+
+def export_table(table: str, output: TextIO, fmt: str, chunk_size: int, server_id: Optional[int] = None) -> int:
+  columns = list(TABLES[table]['columns'])
+  query = f'SELECT {", ".join(columns)} FROM {table}'
+  params = ()
+  if server_id is not None:
+    query += ' WHERE server_id = ?'
+    params = (server_id,)
+  progress = Progress('Exported', table)
+  cur = db.conn.cursor()
+  cur.execute(query, params)
+  if fmt == 'csv':
+    writer = csv.writer(output)
+    writer.writerow(columns)
+  # fetchmany keeps only one chunk of rows in memory at a time
+  while True:
+    rows = cur.fetchmany(chunk_size)
+    if not rows:
+      break
+    if fmt == 'csv':
+      writer.writerows(rows)
+    else:
+      output.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+    progress.add(len(rows))
+  cur.close()
+  progress.done()
+  return progress.rows
+
+def _read_rows(table: str, input: TextIO, fmt: str) -> Iterator[Dict[str, object]]:
+  if fmt == 'jsonl':
+    for (line_number, line) in enumerate(input, 1):
+      if not line.strip():
+        continue
+      try:
+        yield json.loads(line)
+      except ValueError as e:
+        raise ValueError(f'Invalid JSON on line {line_number}: {e}') from e
+    return
+  column_types = TABLES[table]['columns']
+  for row in csv.DictReader(input):
+    # CSV only has strings; empty integer cells are NULLs
+    yield {column: (int(value) if value != '' else None) if column_types.get(column) is int else value for (column, value) in row.items()}
+
+def import_table(table: str, input: TextIO, fmt: str, chunk_size: int, replace: bool = True) -> int:
+  columns = list(TABLES[table]['columns'])
+  key = TABLES[table]['key']
+  query = f'INSERT OR {"REPLACE" if replace else "IGNORE"} INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+  progress = Progress('Imported', table)
+  chunk: List[tuple] = []
+
+  def flush():
+    # One transaction per chunk keeps the WAL from growing with the size of the import
+    with db.conn:
+      db.conn.executemany(query, chunk)
+    progress.add(len(chunk))
+    chunk.clear()
+
+  for (i, row) in enumerate(_read_rows(table, input, fmt), 1):
+    missing = [column for column in key if row.get(column) is None]
+    if missing:
+      raise ValueError(f'Row {i} is missing {", ".join(missing)}')
+    chunk.append(tuple(row.get(column) for column in columns))
+    if len(chunk) >= chunk_size:
+      flush()
+  if chunk:
+    flush()
+  progress.done()
+  return progress.rows
+
+# Streaming import/export of the bot's tables as JSONL or CSV, for backfills and for moving servers between deployments.
+# The bot keeps some of this data in memory, so imports should be done while it's stopped.
+def main():
+  pyLogging.basicConfig(level=pyLogging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s', stream=sys.stderr)
+  parser = argparse.ArgumentParser(description='Import or export SoupBot data.')
+  parser.add_argument('action', choices=('export', 'import'))
+  parser.add_argument('table', choices=list(TABLES))
+  parser.add_argument('file', nargs='?', default='-', help='file to export to or import from (default: stdout/stdin)')
+  parser.add_argument('--db', default='discord_bot.db', help='path to the SQLite database (default: %(default)s)')
+  parser.add_argument('--format', choices=FORMATS, help='file format (default: from the file extension, or jsonl)')
+  parser.add_argument('--chunk-size', type=int, default=10000, help='rows per fetch or insert batch (default: %(default)s)')
+  parser.add_argument('--server-id', type=int, help='only export rows for this server')
+  parser.add_argument('--skip-existing', action='store_true', help='keep existing rows instead of replacing them on import')
+  args = parser.parse_args()
+
+  fmt = args.format
+  if fmt is None:
+    fmt = 'csv' if args.file.lower().endswith('.csv') else 'jsonl'
+  if args.server_id is not None and (args.action != 'export' or 'server_id' not in TABLES[args.table]['columns']):
+    parser.error('--server-id only applies to exports of tables with a server_id')
+  if args.action == 'export' and not os.path.exists(args.db):
+    logging.error('Database "%s" not found', args.db)
+    sys.exit(1)
+
+  db.init(args.db)
+  try:
+    if args.action == 'export':
+      if args.file == '-':
+        export_table(args.table, sys.stdout, fmt, args.chunk_size, args.server_id)
+      else:
+        with open(args.file, 'w', newline='', encoding='utf-8') as output:
+          export_table(args.table, output, fmt, args.chunk_size, args.server_id)
+    else:
+      if args.file == '-':
+        import_table(args.table, sys.stdin, fmt, args.chunk_size, not args.skip_existing)
+      else:
+        with open(args.file, newline='', encoding='utf-8') as input:
+          import_table(args.table, input, fmt, args.chunk_size, not args.skip_existing)
+  except (ValueError, KeyError) as e:
+    logging.error('Failed to %s "%s": %s', args.action, args.table, e)
+    sys.exit(1)
+  finally:
+    db.close()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,102 @@
+import asyncio
+import collections
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+MISSING = object()
+
+
+class LRUCache:
+  """Bounded mapping with least-recently-used eviction and an optional per-entry TTL (in seconds)."""
+
+  def __init__(self, max_size: int, ttl: Optional[float] = None):
+    self.max_size = max_size
+    self.ttl = ttl
+    self._entries = collections.OrderedDict()
+    self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key: Hashable, default: Any = None) -> Any:
+    entry = self._entries.get(key, MISSING)
+    if entry is MISSING:
+      self.stats['misses'] += 1
+      return default
+    value, expires_at = entry
+    if expires_at is not None and expires_at <= time.monotonic():
+      del self._entries[key]
+      self.stats['expirations'] += 1
+      self.stats['misses'] += 1
+      return default
+    self._entries.move_to_end(key)
+    self.stats['hits'] += 1
+    return value
+
+  def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+    if self.max_size <= 0:
+      return
+    if ttl is None:
+      ttl = self.ttl
+    self._entries[key] = (value, time.monotonic() + ttl if ttl is not None else None)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.max_size:
+      self._entries.popitem(last=False)
+      self.stats['evictions'] += 1
+
+  def invalidate(self, key: Hashable):
+    self._entries.pop(key, None)
+
+  def clear(self):
+    self._entries.clear()
+
+
+class _Call:
+  __slots__ = ('task', 'waiters')
+
+  def __init__(self, task: asyncio.Future):
+    self.task = task
+    self.waiters = 0
+
+
+class SingleFlight:
+  """Coalesces concurrent calls sharing the same key, so that only one of them is actually in flight."""
+
+  def __init__(self):
+    self._in_flight = {}
+    self.stats = {'calls': 0, 'coalesced': 0, 'cancelled': 0}
+
+  def __len__(self):
+    return len(self._in_flight)
+
+  async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+    call = self._in_flight.get(key)
+    if call is None:
+      self.stats['calls'] += 1
+      call = _Call(asyncio.ensure_future(fn()))
+      self._in_flight[key] = call
+      call.task.add_done_callback(lambda t: self._on_done(key, call))
+    else:
+      self.stats['coalesced'] += 1
+    call.waiters += 1
+    try:
+      # Shielded, so that a cancelled caller doesn't cancel the call for everyone else waiting on it
+      return await asyncio.shield(call.task)
+    finally:
+      call.waiters -= 1
+      # Once every caller has given up, nobody needs the result, so stop the call itself (e.g. a request to Wit)
+      if call.waiters == 0 and not call.task.done():
+        self.stats['cancelled'] += 1
+        call.task.cancel()
+        # New callers shouldn't join a cancelled call
+        self._forget(key, call)
+
+  def _forget(self, key: Hashable, call: _Call):
+    if self._in_flight.get(key) is call:
+      del self._in_flight[key]
+
+  def _on_done(self, key: Hashable, call: _Call):
+    self._forget(key, call)
+    # Mark the exception as retrieved, in case every caller has given up on it
+    if not call.task.cancelled():
+      call.task.exception()
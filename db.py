@@ -1,28 +1,165 @@
+import contextlib
 import datetime
+import logging as pyLogging
 import sqlite3
-from typing import Optional, List, Tuple
+import time
+from typing import Any, Callable, Dict, Optional, List, Tuple
 
+import leaderboard
 import utils
 
 DINKDONK_RESET_PRIVILEGE_MINIMUM = 50
 
+# Applied in order on startup; the index of the last applied migration (plus one) is stored in PRAGMA user_version.
+# Never edit a migration that has already been released, append a new one instead.
+MIGRATIONS = [
+  # 1: Initial schema
+  '''
+  CREATE TABLE IF NOT EXISTS users(id VARCHAR(24) PRIMARY KEY, tz TEXT, last_modified TEXT);
+  CREATE TABLE IF NOT EXISTS dinkdonk(server_id VARCHAR(24), user_id VARCHAR(24), count INTEGER, lifetime_count INTEGER, should_alert INTEGER DEFAULT FALSE, last_modified TEXT, PRIMARY KEY (server_id, user_id));
+  CREATE TABLE IF NOT EXISTS cross_dinkdonks(server_id VARCHAR(24), to_user_id VARCHAR(24), from_user_id VARCHAR(24), count INTEGER, last_modified TEXT, PRIMARY KEY (server_id, to_user_id, from_user_id));
+  CREATE TABLE IF NOT EXISTS dinkdonk_cache(server_id VARCHAR(24) PRIMARY KEY, value INTEGER);
+  CREATE TABLE IF NOT EXISTS availability(server_id VARCHAR(24), user_id VARCHAR(24), on_date VARCHAR(10), is_available INTEGER, description TEXT, last_modified TEXT, PRIMARY KEY (server_id, user_id, on_date));
+  ''',
+  # 2: Indexes for leaderboards and availability lookups
+  '''
+  CREATE INDEX IF NOT EXISTS dinkdonk_server_count ON dinkdonk(server_id, count);
+  CREATE INDEX IF NOT EXISTS availability_server_date ON availability(server_id, on_date);
+  ''',
+  # 3: Store Discord IDs as integers and last_modified as epoch seconds
+  '''
+  CREATE TABLE users_new(id INTEGER PRIMARY KEY, tz TEXT, last_modified INTEGER);
+  INSERT INTO users_new SELECT CAST(id AS INTEGER), tz, CAST(strftime('%s', last_modified) AS INTEGER) FROM users;
+  DROP TABLE users;
+  ALTER TABLE users_new RENAME TO users;
+
+  CREATE TABLE dinkdonk_new(server_id INTEGER, user_id INTEGER, count INTEGER, lifetime_count INTEGER, should_alert INTEGER DEFAULT FALSE, last_modified INTEGER, PRIMARY KEY (server_id, user_id)) WITHOUT ROWID;
+  INSERT INTO dinkdonk_new SELECT CAST(server_id AS INTEGER), CAST(user_id AS INTEGER), count, lifetime_count, should_alert, CAST(strftime('%s', last_modified) AS INTEGER) FROM dinkdonk;
+  DROP TABLE dinkdonk;
+  ALTER TABLE dinkdonk_new RENAME TO dinkdonk;
+  CREATE INDEX dinkdonk_server_count ON dinkdonk(server_id, count);
+
+  CREATE TABLE cross_dinkdonks_new(server_id INTEGER, to_user_id INTEGER, from_user_id INTEGER, count INTEGER, last_modified INTEGER, PRIMARY KEY (server_id, to_user_id, from_user_id)) WITHOUT ROWID;
+  INSERT INTO cross_dinkdonks_new SELECT CAST(server_id AS INTEGER), CAST(to_user_id AS INTEGER), CAST(from_user_id AS INTEGER), count, CAST(strftime('%s', last_modified) AS INTEGER) FROM cross_dinkdonks;
+  DROP TABLE cross_dinkdonks;
+  ALTER TABLE cross_dinkdonks_new RENAME TO cross_dinkdonks;
+
+  CREATE TABLE dinkdonk_cache_new(server_id INTEGER PRIMARY KEY, value INTEGER);
+  INSERT INTO dinkdonk_cache_new SELECT CAST(server_id AS INTEGER), value FROM dinkdonk_cache;
+  DROP TABLE dinkdonk_cache;
+  ALTER TABLE dinkdonk_cache_new RENAME TO dinkdonk_cache;
+
+  CREATE TABLE availability_new(server_id INTEGER, user_id INTEGER, on_date VARCHAR(10), is_available INTEGER, description TEXT, last_modified INTEGER, PRIMARY KEY (server_id, user_id, on_date)) WITHOUT ROWID;
+  INSERT INTO availability_new SELECT CAST(server_id AS INTEGER), CAST(user_id AS INTEGER), on_date, is_available, description, CAST(strftime('%s', last_modified) AS INTEGER) FROM availability;
+  DROP TABLE availability;
+  ALTER TABLE availability_new RENAME TO availability;
+  CREATE INDEX availability_server_date ON availability(server_id, on_date);
+  ''',
+  # 4: Persistent cache of Wit results, by normalized query and UTC offset
+  '''
+  CREATE TABLE nlp_cache(query TEXT NOT NULL, tz_offset INTEGER NOT NULL, doc TEXT NOT NULL, expires_at INTEGER NOT NULL, last_used INTEGER NOT NULL, PRIMARY KEY (query, tz_offset));
+  CREATE INDEX nlp_cache_last_used ON nlp_cache(last_used);
+  ''',
+]
+
+PRAGMAS = {
+  'journal_mode': 'WAL',
+  # Safe from corruption in WAL mode; only the last commits may be lost on power failure
+  'synchronous': 'NORMAL',
+  # Negative values are in KiB
+  'cache_size': -16000,
+  'mmap_size': 64 * 1024 * 1024,
+  'temp_store': 'MEMORY',
+  'busy_timeout': 5000,
+}
+
+logging = pyLogging.getLogger('soupbot.db')
 conn = None
+_in_batch = False
+# In-memory leaderboard indexes, loaded lazily per server and only ever touched from the DB thread
+_leaderboards = {}
 
 
-def init():
+def init(path: str = 'discord_bot.db'):
   global conn
-  conn = sqlite3.connect('discord_bot.db')
+  conn = sqlite3.connect(path)
+  for (pragma, value) in PRAGMAS.items():
+    conn.execute(f'PRAGMA {pragma} = {value}')
+  migrate(conn)
+
+def migrate(connection: sqlite3.Connection):
+  version = connection.execute('PRAGMA user_version').fetchone()[0]
+  for (i, script) in enumerate(MIGRATIONS[version:], start=version + 1):
+    logging.info('Applying DB migration %d', i)
+    try:
+      connection.executescript(f'BEGIN;\n{script}\nPRAGMA user_version = {i};\nCOMMIT;')
+    except Exception:
+      connection.rollback()
+      raise
+
+def close():
+  global conn
+  if conn:
+    conn.close()
+    conn = None
+  _leaderboards.clear()
+
+def _to_epoch(timestamp: Optional[datetime.datetime]) -> int:
+  return utils.datetime_to_timestamp(timestamp) if timestamp else int(time.time())
+
+@contextlib.contextmanager
+def _transaction():
+  # Inside run_batch, the surrounding batch transaction takes care of committing
+  if _in_batch:
+    yield
+  else:
+    with conn:
+      yield
+
+# Runs several write functions in a single transaction, returning a (success, result or exception) pair for each call.
+# Every call gets its own savepoint, so that a failing call doesn't discard the rest of the batch.
+def run_batch(calls: List[Tuple[Callable, tuple, dict]]) -> List[Tuple[bool, Any]]:
+  global _in_batch
+  if not conn:
+    raise ValueError('DB not initialized!')
+  results = []
+  try:
+    with conn:
+      cur = conn.cursor()
+      cur.execute('BEGIN')
+      _in_batch = True
+      try:
+        for (fn, args, kwargs) in calls:
+          cur.execute('SAVEPOINT batch_call')
+          try:
+            results.append((True, fn(*args, **kwargs)))
+          except Exception as e:
+            cur.execute('ROLLBACK TO batch_call')
+            results.append((False, e))
+          cur.execute('RELEASE batch_call')
+      finally:
+        _in_batch = False
+        cur.close()
+  except Exception:
+    # The in-memory indexes may have seen writes that were rolled back, so rebuild them from scratch
+    _leaderboards.clear()
+    raise
+  return results
+
+def _get_leaderboard(server_id: int) -> leaderboard.ServerLeaderboard:
+  server_leaderboard = _leaderboards.get(server_id)
+  if server_leaderboard is None:
+    server_leaderboard = leaderboard.ServerLeaderboard(get_dinkdonks_for_server(server_id))
+    _leaderboards[server_id] = server_leaderboard
+  return server_leaderboard
 
 def set_timezone_for_user_id(user_id: int, tz: Optional[str], timestamp: Optional[datetime.datetime] = None):
   if not conn:
     raise ValueError('DB not initialized!')
-  if not timestamp:
-    timestamp = datetime.datetime.utcnow()
-  else:
-    timestamp = datetime.datetime.utcfromtimestamp(timestamp.timestamp())
-  with conn:
+  last_modified = _to_epoch(timestamp)
+  with _transaction():
     cur = conn.cursor()
-    cur.execute('INSERT INTO users (id, tz, last_modified) VALUES (?, ?, ?) ON CONFLICT(id) DO UPDATE SET tz = excluded.tz, last_modified = excluded.last_modified', (str(user_id), tz, timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')))
+    cur.execute('INSERT INTO users (id, tz, last_modified) VALUES (?, ?, ?) ON CONFLICT(id) DO UPDATE SET tz = excluded.tz, last_modified = excluded.last_modified', (user_id, tz, last_modified))
     cur.close()
 
 def get_timezone_for_user_id(user_id: int) -> Optional[str]:
@@ -30,7 +167,7 @@ def get_timezone_for_user_id(user_id: int) -> Optional[str]:
     raise ValueError('DB not initialized!')
   with conn:
     cur = conn.cursor()
-    res = cur.execute('SELECT tz FROM users WHERE id = ?', (str(user_id),))
+    res = cur.execute('SELECT tz FROM users WHERE id = ?', (user_id,))
     value: Optional[Tuple[str]] = res.fetchone()
     cur.close()
     return value[0] if value else None
@@ -38,26 +175,25 @@ def get_timezone_for_user_id(user_id: int) -> Optional[str]:
 def save_dinkdonk_for_user(user_id: int, server_id: int, from_user_id: Optional[int] = None, timestamp: Optional[datetime.datetime] = None):
   if not conn:
     raise ValueError('DB not initialized!')
-  if not timestamp:
-    timestamp = datetime.datetime.utcnow()
-  else:
-    timestamp = datetime.datetime.utcfromtimestamp(timestamp.timestamp())
-  with conn:
+  last_modified = _to_epoch(timestamp)
+  with _transaction():
     cur = conn.cursor()
-    cur.execute('INSERT INTO dinkdonk (server_id, user_id, count, lifetime_count, should_alert, last_modified) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(server_id, user_id) DO UPDATE SET count = dinkdonk.count + 1, lifetime_count = dinkdonk.lifetime_count + 1, last_modified = excluded.last_modified', (str(server_id), str(user_id), 1, 1, 0, timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')))
+    cur.execute('INSERT INTO dinkdonk (server_id, user_id, count, lifetime_count, should_alert, last_modified) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(server_id, user_id) DO UPDATE SET count = dinkdonk.count + 1, lifetime_count = dinkdonk.lifetime_count + 1, last_modified = excluded.last_modified', (server_id, user_id, 1, 1, 0, last_modified))
     if from_user_id:
-      cur.execute('INSERT INTO cross_dinkdonks (server_id, to_user_id, from_user_id, count, last_modified) VALUES (?, ?, ?, ?, ?) ON CONFLICT(server_id, to_user_id, from_user_id) DO UPDATE SET count = cross_dinkdonks.count + 1, last_modified = excluded.last_modified', (str(server_id), str(user_id), str(from_user_id), 1, timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')))
-    res = cur.execute('SELECT count FROM dinkdonk WHERE server_id = ? AND user_id = ?', (str(server_id), str(user_id)))
+      cur.execute('INSERT INTO cross_dinkdonks (server_id, to_user_id, from_user_id, count, last_modified) VALUES (?, ?, ?, ?, ?) ON CONFLICT(server_id, to_user_id, from_user_id) DO UPDATE SET count = cross_dinkdonks.count + 1, last_modified = excluded.last_modified', (server_id, user_id, from_user_id, 1, last_modified))
+    res = cur.execute('SELECT count FROM dinkdonk WHERE server_id = ? AND user_id = ?', (server_id, user_id))
     value: Tuple[int] = res.fetchone()
     cur.close()
-    return value[0]
+  if server_id in _leaderboards:
+    _leaderboards[server_id].set_count(user_id, value[0])
+  return value[0]
 
 def get_all_dinkdonks_for_user(user_id: int, server_id: int) -> Tuple[int, int]:
   if not conn:
     raise ValueError('DB not initialized!')
   with conn:
     cur = conn.cursor()
-    res = cur.execute('SELECT count, lifetime_count FROM dinkdonk WHERE user_id = ? AND server_id = ?', (str(user_id), str(server_id)))
+    res = cur.execute('SELECT count, lifetime_count FROM dinkdonk WHERE user_id = ? AND server_id = ?', (user_id, server_id))
     value: Optional[Tuple[int, int]] = res.fetchone()
     cur.close()
     return value if value else (0, 0)
@@ -67,8 +203,8 @@ def get_cross_dinkdonks_at_user(user_id: int, server_id: int):
     raise ValueError('DB not initialized!')
   with conn:
     cur = conn.cursor()
-    res = cur.execute('SELECT from_user_id, count FROM cross_dinkdonks WHERE to_user_id = ? AND server_id = ?', (str(user_id), str(server_id)))
-    values: List[Tuple[str, int]] = res.fetchall()
+    res = cur.execute('SELECT from_user_id, count FROM cross_dinkdonks WHERE to_user_id = ? AND server_id = ?', (user_id, server_id))
+    values: List[Tuple[int, int]] = res.fetchall()
     cur.close()
     return values
 
@@ -77,21 +213,28 @@ def get_dinkdonks_for_server(server_id: int):
     raise ValueError('DB not initialized!')
   with conn:
     cur = conn.cursor()
-    res = cur.execute('SELECT user_id, count FROM dinkdonk WHERE server_id = ? AND count > 0', (str(server_id),))
-    values: List[Tuple[str, int]] = res.fetchall()
+    res = cur.execute('SELECT user_id, count FROM dinkdonk WHERE server_id = ? AND count > 0', (server_id,))
+    values: List[Tuple[int, int]] = res.fetchall()
     cur.close()
     return values
 
+def get_ranked_dinkdonks_for_server(server_id: int, cut_off_at_length: Optional[int] = None) -> List[Tuple[int, List[int]]]:
+  if not conn:
+    raise ValueError('DB not initialized!')
+  return _get_leaderboard(server_id).rank(cut_off_at_length)
+
+def get_dinkdonk_place_for_user(user_id: int, server_id: int) -> Optional[int]:
+  if not conn:
+    raise ValueError('DB not initialized!')
+  return _get_leaderboard(server_id).place_of(user_id)
+
 def toggle_dinkdonk_alerts(user_id: int, server_id: int, timestamp: Optional[datetime.datetime] = None):
   if not conn:
     raise ValueError('DB not initialized!')
-  if not timestamp:
-    timestamp = datetime.datetime.utcnow()
-  else:
-    timestamp = datetime.datetime.utcfromtimestamp(timestamp.timestamp())
+  last_modified = _to_epoch(timestamp)
   with conn:
     cur = conn.cursor()
-    cur.execute('INSERT INTO dinkdonk (server_id, user_id, count, lifetime_count, should_alert, last_modified) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(server_id, user_id) DO UPDATE SET should_alert = MAX(0, 1 - dinkdonk.should_alert)', (str(server_id), str(user_id), 0, 0, 1, timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')))
+    cur.execute('INSERT INTO dinkdonk (server_id, user_id, count, lifetime_count, should_alert, last_modified) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(server_id, user_id) DO UPDATE SET should_alert = MAX(0, 1 - dinkdonk.should_alert)', (server_id, user_id, 0, 0, 1, last_modified))
     cur.close()
 
 def get_dinkdonk_should_alert(user_id: int, server_id: int):
@@ -99,7 +242,7 @@ def get_dinkdonk_should_alert(user_id: int, server_id: int):
     raise ValueError('DB not initialized!')
   with conn:
     cur = conn.cursor()
-    res = cur.execute('SELECT should_alert FROM dinkdonk WHERE server_id = ? AND user_id = ?', (str(server_id), str(user_id)))
+    res = cur.execute('SELECT should_alert FROM dinkdonk WHERE server_id = ? AND user_id = ?', (server_id, user_id))
     value: Tuple[int] = res.fetchone()
     cur.close()
     return bool(value[0]) if value else False
@@ -107,63 +250,51 @@ def get_dinkdonk_should_alert(user_id: int, server_id: int):
 def check_if_has_reset_privilege(user_id: int, server_id: int, threshold: int = None) -> bool:
   if not conn:
     raise ValueError('DB not initialized!')
-  with conn:
-    user_id = str(user_id)
-    cur = conn.cursor()
-    res = cur.execute('SELECT user_id, count FROM dinkdonk WHERE server_id = ? AND count >= ?', (str(server_id), DINKDONK_RESET_PRIVILEGE_MINIMUM))
-    values = res.fetchall()
-    cur.close()
-    if len(values) == 0:
-      return False
-    max_user_id, max_count = values[0]
-    for curr_user_id, curr_count in values[1:]:
-      if curr_count >= max_count:
-        max_user_id, max_count = curr_user_id, curr_count
-    return (threshold is not None and max_count >= threshold) or max_user_id == user_id
+  champion = _get_leaderboard(server_id).champion
+  if champion is None:
+    return False
+  max_user_id, max_count = champion
+  if max_count < DINKDONK_RESET_PRIVILEGE_MINIMUM:
+    return False
+  return (threshold is not None and max_count >= threshold) or max_user_id == user_id
 
 def clear_server_dinkdonks(server_id: int, timestamp: Optional[datetime.datetime] = None):
   if not conn:
     raise ValueError('DB not initialized!')
-  if not timestamp:
-    timestamp = datetime.datetime.utcnow()
-  else:
-    timestamp = datetime.datetime.utcfromtimestamp(timestamp.timestamp())
+  last_modified = _to_epoch(timestamp)
   with conn:
     cur = conn.cursor()
-    cur.execute('UPDATE dinkdonk SET count = 0, last_modified = ? WHERE server_id = ?', (timestamp.strftime('%Y-%m-%dT%H:%M:%SZ'), str(server_id)))
-    cur.execute('UPDATE cross_dinkdonks SET count = 0, last_modified = ? WHERE server_id = ?', (timestamp.strftime('%Y-%m-%dT%H:%M:%SZ'), str(server_id)))
+    cur.execute('UPDATE dinkdonk SET count = 0, last_modified = ? WHERE server_id = ?', (last_modified, server_id))
+    cur.execute('UPDATE cross_dinkdonks SET count = 0, last_modified = ? WHERE server_id = ?', (last_modified, server_id))
     cur.close()
+  if server_id in _leaderboards:
+    _leaderboards[server_id].clear()
 
-def get_dd_cache(server_id: int) -> Optional[datetime.datetime]:
+def get_all_dd_cache() -> Dict[int, Optional[datetime.datetime]]:
   if not conn:
     raise ValueError('DB not initialized!')
   with conn:
     cur = conn.cursor()
-    res = cur.execute('SELECT value FROM dinkdonk_cache WHERE server_id = ?', (str(server_id),))
-    value: Optional[Tuple[int]] = res.fetchone()
+    res = cur.execute('SELECT server_id, value FROM dinkdonk_cache')
+    values: List[Tuple[int, Optional[int]]] = res.fetchall()
     cur.close()
-    if value and value[0]:
-      return datetime.datetime.fromtimestamp(value[0])
-    return None
+    return {server_id: datetime.datetime.fromtimestamp(value) if value else None for (server_id, value) in values}
 
 def set_dd_cache(server_id: int, value: Optional[datetime.datetime]):
   if not conn:
     raise ValueError('DB not initialized!')
-  with conn:
+  with _transaction():
     cur = conn.cursor()
-    cur.execute('INSERT INTO dinkdonk_cache (server_id, value) VALUES (?, ?) ON CONFLICT(server_id) DO UPDATE SET value = excluded.value', (str(server_id), utils.datetime_to_timestamp(value) if value else None))
+    cur.execute('INSERT INTO dinkdonk_cache (server_id, value) VALUES (?, ?) ON CONFLICT(server_id) DO UPDATE SET value = excluded.value', (server_id, utils.datetime_to_timestamp(value) if value else None))
     cur.close()
 
 def set_availability_for_user(server_id: int, user_id: int, on_date: datetime.date, is_available: bool, description: str, timestamp: Optional[datetime.datetime] = None):
   if not conn:
     raise ValueError('DB not initialized!')
-  if not timestamp:
-    timestamp = datetime.datetime.utcnow()
-  else:
-    timestamp = datetime.datetime.utcfromtimestamp(timestamp.timestamp())
-  with conn:
+  last_modified = _to_epoch(timestamp)
+  with _transaction():
     cur = conn.cursor()
-    cur.execute('INSERT INTO availability (server_id, user_id, on_date, is_available, description, last_modified) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(server_id, user_id, on_date) DO UPDATE SET is_available = excluded.is_available, description = excluded.description, last_modified = excluded.last_modified', (str(server_id), str(user_id), on_date.isoformat(), int(is_available), description, timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')))
+    cur.execute('INSERT INTO availability (server_id, user_id, on_date, is_available, description, last_modified) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(server_id, user_id, on_date) DO UPDATE SET is_available = excluded.is_available, description = excluded.description, last_modified = excluded.last_modified', (server_id, user_id, on_date.isoformat(), int(is_available), description, last_modified))
     cur.close()
 
 def get_availabilities_for_date(server_id: int, on_date: datetime.date):
@@ -171,7 +302,61 @@ def get_availabilities_for_date(server_id: int, on_date: datetime.date):
     raise ValueError('DB not initialized!')
   with conn:
     cur = conn.cursor()
-    res = cur.execute('SELECT user_id, is_available, description FROM availability WHERE server_id = ? AND on_date = ?', (str(server_id), on_date))
-    values: List[Tuple[str, int, str]] = res.fetchall()
+    res = cur.execute('SELECT user_id, is_available, description FROM availability WHERE server_id = ? AND on_date = ?', (server_id, on_date.isoformat()))
+    values: List[Tuple[int, int, str]] = res.fetchall()
+    cur.close()
+    return values
+
+def get_availabilities_for_range(server_id: int, start_date: datetime.date, end_date: datetime.date) -> List[Tuple[datetime.date, int, int, str]]:
+  if not conn:
+    raise ValueError('DB not initialized!')
+  with conn:
+    cur = conn.cursor()
+    # A single scan over the availability_server_date index
+    res = cur.execute('SELECT on_date, user_id, is_available, description FROM availability WHERE server_id = ? AND on_date BETWEEN ? AND ? ORDER BY on_date', (server_id, start_date.isoformat(), end_date.isoformat()))
+    values = [(datetime.date.fromisoformat(on_date), user_id, is_available, description) for (on_date, user_id, is_available, description) in res.fetchall()]
     cur.close()
     return values
+
+# Only refresh last_used when it's older than this, so that cache hits don't all turn into writes
+NLP_CACHE_TOUCH_INTERVAL = 3600
+
+def get_nlp_cache(query: str, tz_offset: int, now: int) -> Optional[str]:
+  if not conn:
+    raise ValueError('DB not initialized!')
+  with _transaction():
+    cur = conn.cursor()
+    res = cur.execute('SELECT doc, expires_at, last_used FROM nlp_cache WHERE query = ? AND tz_offset = ?', (query, tz_offset))
+    value: Optional[Tuple[str, int, int]] = res.fetchone()
+    if value is None:
+      cur.close()
+      return None
+    (doc, expires_at, last_used) = value
+    if expires_at <= now:
+      cur.execute('DELETE FROM nlp_cache WHERE query = ? AND tz_offset = ?', (query, tz_offset))
+      doc = None
+    elif last_used < now - NLP_CACHE_TOUCH_INTERVAL:
+      cur.execute('UPDATE nlp_cache SET last_used = ? WHERE query = ? AND tz_offset = ?', (now, query, tz_offset))
+    cur.close()
+    return doc
+
+def set_nlp_cache(query: str, tz_offset: int, doc: str, expires_at: int, now: int):
+  if not conn:
+    raise ValueError('DB not initialized!')
+  with _transaction():
+    cur = conn.cursor()
+    cur.execute('INSERT INTO nlp_cache (query, tz_offset, doc, expires_at, last_used) VALUES (?, ?, ?, ?, ?) ON CONFLICT(query, tz_offset) DO UPDATE SET doc = excluded.doc, expires_at = excluded.expires_at, last_used = excluded.last_used', (query, tz_offset, doc, expires_at, now))
+    cur.close()
+
+# Deletes expired entries, then the least recently used ones over max_size. Returns the number of deleted entries.
+def prune_nlp_cache(max_size: int, now: int) -> int:
+  if not conn:
+    raise ValueError('DB not initialized!')
+  with _transaction():
+    cur = conn.cursor()
+    deleted = cur.execute('DELETE FROM nlp_cache WHERE expires_at <= ?', (now,)).rowcount
+    (size,) = cur.execute('SELECT COUNT(*) FROM nlp_cache').fetchone()
+    if size > max_size:
+      deleted += cur.execute('DELETE FROM nlp_cache WHERE rowid IN (SELECT rowid FROM nlp_cache ORDER BY last_used LIMIT ?)', (size - max_size,)).rowcount
+    cur.close()
+    return deleted
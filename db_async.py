@@ -0,0 +1,167 @@
+import asyncio
+import concurrent.futures
+import datetime
+import functools
+import logging as pyLogging
+from typing import Optional
+
+import cache
+import db
+import env
+import tracing
+
+logging = pyLogging.getLogger('soupbot.db')
+executor = None
+write_behind = False
+# Queued (fn, args, kwargs, future) writes, when running in write-behind mode
+_pending = []
+_flush_handle = None
+# User ID -> timezone name (or None when unset), invalidated by set_timezone_for_user_id
+tz_cache = cache.LRUCache(0)
+# Server ID -> next time $dinkdonk is available, loaded once on init and written through on change
+_dd_cache = {}
+
+
+def init():
+  global executor, write_behind
+  tz_cache.max_size = env.TZ_CACHE_SIZE
+  # Other processes may change a user's timezone, so entries can only be trusted for a while
+  tz_cache.ttl = env.TZ_CACHE_TTL if env.PROCESS_COUNT > 1 else None
+  executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='soupbot-db')
+  write_behind = env.DB_WRITE_BEHIND
+  # The connection is opened on the executor thread, which owns it from then on
+  executor.submit(db.init, env.DB_PATH).result()
+  _dd_cache.clear()
+  _dd_cache.update(executor.submit(db.get_all_dd_cache).result())
+
+async def close():
+  global executor
+  if not executor:
+    return
+  await flush()
+  await _run(db.close)
+  executor.shutdown()
+  executor = None
+  logging.info('Timezone cache stats: %s', tz_cache.stats)
+  tz_cache.clear()
+
+async def _run(fn, *args, **kwargs):
+  if not executor:
+    raise ValueError('DB not initialized!')
+  # Queued writes must land before anything else runs, so that callers can read their own writes
+  _start_flush()
+  loop = asyncio.get_running_loop()
+  with tracing.span(f'db.{fn.__name__}'):
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+def _start_flush():
+  global _pending, _flush_handle
+  if _flush_handle:
+    _flush_handle.cancel()
+    _flush_handle = None
+  if not _pending:
+    return None
+  batch, _pending = _pending, []
+  loop = asyncio.get_running_loop()
+  batch_future = loop.run_in_executor(executor, db.run_batch, [(fn, args, kwargs) for (fn, args, kwargs, _) in batch])
+  batch_future.add_done_callback(lambda f: _resolve_batch(batch, f))
+  return batch_future
+
+def _resolve_batch(batch, batch_future: asyncio.Future):
+  if batch_future.cancelled():
+    results = [(False, asyncio.CancelledError())] * len(batch)
+  elif batch_future.exception():
+    logging.error('Failed to flush %d queued writes', len(batch))
+    results = [(False, batch_future.exception())] * len(batch)
+  else:
+    results = batch_future.result()
+  for ((_, _, _, future), (success, value)) in zip(batch, results):
+    if future.done():
+      continue
+    if success:
+      future.set_result(value)
+    else:
+      future.set_exception(value)
+
+async def flush():
+  batch_future = _start_flush()
+  if batch_future:
+    await asyncio.wait([batch_future])
+
+def _wrap(fn):
+  @functools.wraps(fn)
+  async def wrapper(*args, **kwargs):
+    return await _run(fn, *args, **kwargs)
+  return wrapper
+
+def _wrap_write(fn):
+  @functools.wraps(fn)
+  async def wrapper(*args, **kwargs):
+    global _flush_handle
+    if not write_behind:
+      return await _run(fn, *args, **kwargs)
+    if not executor:
+      raise ValueError('DB not initialized!')
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _pending.append((fn, args, kwargs, future))
+    # Group commit: flush once enough writes are queued, or after a short delay otherwise
+    if len(_pending) >= env.DB_FLUSH_MAX_OPS:
+      _start_flush()
+    elif not _flush_handle:
+      _flush_handle = loop.call_later(env.DB_FLUSH_INTERVAL_MS / 1000, _start_flush)
+    with tracing.span(f'db.{fn.__name__}'):
+      return await future
+  return wrapper
+
+_set_timezone_for_user_id = _wrap_write(db.set_timezone_for_user_id)
+_get_timezone_for_user_id = _wrap(db.get_timezone_for_user_id)
+
+@functools.wraps(db.set_timezone_for_user_id)
+async def set_timezone_for_user_id(user_id, tz, *args, **kwargs):
+  # Reads while the write is pending go to the DB, which flushes queued writes first
+  tz_cache.invalidate(user_id)
+  result = await _set_timezone_for_user_id(user_id, tz, *args, **kwargs)
+  tz_cache.set(user_id, tz)
+  return result
+
+@functools.wraps(db.get_timezone_for_user_id)
+async def get_timezone_for_user_id(user_id):
+  tz = tz_cache.get(user_id, cache.MISSING)
+  if tz is cache.MISSING:
+    tz = await _get_timezone_for_user_id(user_id)
+    tz_cache.set(user_id, tz)
+  return tz
+
+save_dinkdonk_for_user = _wrap_write(db.save_dinkdonk_for_user)
+get_all_dinkdonks_for_user = _wrap(db.get_all_dinkdonks_for_user)
+get_cross_dinkdonks_at_user = _wrap(db.get_cross_dinkdonks_at_user)
+get_dinkdonks_for_server = _wrap(db.get_dinkdonks_for_server)
+get_ranked_dinkdonks_for_server = _wrap(db.get_ranked_dinkdonks_for_server)
+get_dinkdonk_place_for_user = _wrap(db.get_dinkdonk_place_for_user)
+toggle_dinkdonk_alerts = _wrap(db.toggle_dinkdonk_alerts)
+get_dinkdonk_should_alert = _wrap(db.get_dinkdonk_should_alert)
+check_if_has_reset_privilege = _wrap(db.check_if_has_reset_privilege)
+clear_server_dinkdonks = _wrap(db.clear_server_dinkdonks)
+_set_dd_cache = _wrap_write(db.set_dd_cache)
+
+async def get_dd_cache(server_id) -> Optional[datetime.datetime]:
+  if not executor:
+    raise ValueError('DB not initialized!')
+  return _dd_cache.get(server_id)
+
+@functools.wraps(db.set_dd_cache)
+async def set_dd_cache(server_id, value):
+  if not executor:
+    raise ValueError('DB not initialized!')
+  if server_id in _dd_cache and _dd_cache[server_id] == value:
+    return
+  # Updated before yielding, so that a concurrent $dinkdonk already sees the new cooldown
+  _dd_cache[server_id] = value
+  await _set_dd_cache(server_id, value)
+set_availability_for_user = _wrap_write(db.set_availability_for_user)
+get_availabilities_for_date = _wrap(db.get_availabilities_for_date)
+get_availabilities_for_range = _wrap(db.get_availabilities_for_range)
+get_nlp_cache = _wrap(db.get_nlp_cache)
+set_nlp_cache = _wrap_write(db.set_nlp_cache)
+prune_nlp_cache = _wrap(db.prune_nlp_cache)
@@ -2,12 +2,76 @@ import os
 
 DISCORD_TOKEN = None
 WIT_TOKEN = None
+WIT_URL = 'https://api.wit.ai/message'
+WIT_CONNECTION_LIMIT = 10
+WIT_KEEPALIVE_TIMEOUT = 30.0
+WIT_MAX_CONCURRENCY = 10
+WIT_TIMEOUT = 10.0
+WIT_MAX_RETRIES = 2
+WIT_BREAKER_THRESHOLD = 5
+WIT_BREAKER_RESET_TIMEOUT = 30.0
+NLP_CACHE_SIZE = 1024
+NLP_CACHE_TTL = 300.0
+NLP_CACHE_BUCKET_SECONDS = 60
+NLP_DISK_CACHE = False
+NLP_DISK_CACHE_SIZE = 10000
+NLP_DISK_CACHE_PRUNE_INTERVAL = 600.0
+LOCAL_NLP = True
+DB_PATH = 'discord_bot.db'
+DB_WRITE_BEHIND = False
+DB_FLUSH_INTERVAL_MS = 50
+DB_FLUSH_MAX_OPS = 100
+TZ_CACHE_SIZE = 4096
+TZ_CACHE_TTL = 60.0
+SHARD_COUNT = None
+PROCESS_COUNT = 1
+LOW_MEMORY = False
+MEMBER_CACHE = 'all'
+MEMBER_INDEX_TTL = 3600.0
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = None
+TRACE = False
+TRACE_SLOW_MS = 500.0
+PROFILE_SAMPLE_RATE = 0
+PROFILE_DIR = 'profiles'
 CUSTOM = {}
 
 def init_env():
-    global DISCORD_TOKEN, WIT_TOKEN, CUSTOM
+    global DISCORD_TOKEN, WIT_TOKEN, WIT_URL, WIT_CONNECTION_LIMIT, WIT_KEEPALIVE_TIMEOUT, WIT_MAX_CONCURRENCY, WIT_TIMEOUT, WIT_MAX_RETRIES, WIT_BREAKER_THRESHOLD, WIT_BREAKER_RESET_TIMEOUT, NLP_CACHE_SIZE, NLP_CACHE_TTL, NLP_CACHE_BUCKET_SECONDS, NLP_DISK_CACHE, NLP_DISK_CACHE_SIZE, NLP_DISK_CACHE_PRUNE_INTERVAL, LOCAL_NLP, DB_PATH, DB_WRITE_BEHIND, DB_FLUSH_INTERVAL_MS, DB_FLUSH_MAX_OPS, TZ_CACHE_SIZE, TZ_CACHE_TTL, SHARD_COUNT, PROCESS_COUNT, LOW_MEMORY, MEMBER_CACHE, MEMBER_INDEX_TTL, METRICS_HOST, METRICS_PORT, TRACE, TRACE_SLOW_MS, PROFILE_SAMPLE_RATE, PROFILE_DIR, CUSTOM
     DISCORD_TOKEN = os.environ['SOUPBOT_DISCORD_TOKEN']
     WIT_TOKEN = os.environ['SOUPBOT_WIT_TOKEN']
+    WIT_URL = os.environ.get('SOUPBOT_WIT_URL', WIT_URL)
+    WIT_CONNECTION_LIMIT = int(os.environ.get('SOUPBOT_WIT_CONNECTION_LIMIT', WIT_CONNECTION_LIMIT))
+    WIT_KEEPALIVE_TIMEOUT = float(os.environ.get('SOUPBOT_WIT_KEEPALIVE_TIMEOUT', WIT_KEEPALIVE_TIMEOUT))
+    WIT_MAX_CONCURRENCY = int(os.environ.get('SOUPBOT_WIT_MAX_CONCURRENCY', WIT_MAX_CONCURRENCY))
+    WIT_TIMEOUT = float(os.environ.get('SOUPBOT_WIT_TIMEOUT', WIT_TIMEOUT))
+    WIT_MAX_RETRIES = int(os.environ.get('SOUPBOT_WIT_MAX_RETRIES', WIT_MAX_RETRIES))
+    WIT_BREAKER_THRESHOLD = int(os.environ.get('SOUPBOT_WIT_BREAKER_THRESHOLD', WIT_BREAKER_THRESHOLD))
+    WIT_BREAKER_RESET_TIMEOUT = float(os.environ.get('SOUPBOT_WIT_BREAKER_RESET_TIMEOUT', WIT_BREAKER_RESET_TIMEOUT))
+    NLP_CACHE_SIZE = int(os.environ.get('SOUPBOT_NLP_CACHE_SIZE', NLP_CACHE_SIZE))
+    NLP_CACHE_TTL = float(os.environ.get('SOUPBOT_NLP_CACHE_TTL', NLP_CACHE_TTL))
+    NLP_CACHE_BUCKET_SECONDS = int(os.environ.get('SOUPBOT_NLP_CACHE_BUCKET_SECONDS', NLP_CACHE_BUCKET_SECONDS))
+    NLP_DISK_CACHE = os.environ.get('SOUPBOT_NLP_DISK_CACHE', '').lower() in ('1', 'true', 'yes')
+    NLP_DISK_CACHE_SIZE = int(os.environ.get('SOUPBOT_NLP_DISK_CACHE_SIZE', NLP_DISK_CACHE_SIZE))
+    NLP_DISK_CACHE_PRUNE_INTERVAL = float(os.environ.get('SOUPBOT_NLP_DISK_CACHE_PRUNE_INTERVAL', NLP_DISK_CACHE_PRUNE_INTERVAL))
+    LOCAL_NLP = os.environ.get('SOUPBOT_LOCAL_NLP', 'true').lower() in ('1', 'true', 'yes')
+    DB_PATH = os.environ.get('SOUPBOT_DB_PATH', DB_PATH)
+    DB_WRITE_BEHIND = os.environ.get('SOUPBOT_DB_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+    DB_FLUSH_INTERVAL_MS = int(os.environ.get('SOUPBOT_DB_FLUSH_INTERVAL_MS', DB_FLUSH_INTERVAL_MS))
+    DB_FLUSH_MAX_OPS = int(os.environ.get('SOUPBOT_DB_FLUSH_MAX_OPS', DB_FLUSH_MAX_OPS))
+    TZ_CACHE_SIZE = int(os.environ.get('SOUPBOT_TZ_CACHE_SIZE', TZ_CACHE_SIZE))
+    TZ_CACHE_TTL = float(os.environ.get('SOUPBOT_TZ_CACHE_TTL', TZ_CACHE_TTL))
+    SHARD_COUNT = int(os.environ['SOUPBOT_SHARD_COUNT']) if os.environ.get('SOUPBOT_SHARD_COUNT') else None
+    PROCESS_COUNT = int(os.environ.get('SOUPBOT_PROCESS_COUNT', PROCESS_COUNT))
+    LOW_MEMORY = os.environ.get('SOUPBOT_LOW_MEMORY', '').lower() in ('1', 'true', 'yes')
+    MEMBER_CACHE = os.environ.get('SOUPBOT_MEMBER_CACHE', 'none' if LOW_MEMORY else MEMBER_CACHE)
+    MEMBER_INDEX_TTL = float(os.environ.get('SOUPBOT_MEMBER_INDEX_TTL', MEMBER_INDEX_TTL))
+    METRICS_HOST = os.environ.get('SOUPBOT_METRICS_HOST', METRICS_HOST)
+    METRICS_PORT = int(os.environ['SOUPBOT_METRICS_PORT']) if os.environ.get('SOUPBOT_METRICS_PORT') else None
+    TRACE = os.environ.get('SOUPBOT_TRACE', '').lower() in ('1', 'true', 'yes')
+    TRACE_SLOW_MS = float(os.environ.get('SOUPBOT_TRACE_SLOW_MS', TRACE_SLOW_MS))
+    PROFILE_SAMPLE_RATE = int(os.environ.get('SOUPBOT_PROFILE_SAMPLE_RATE', PROFILE_SAMPLE_RATE))
+    PROFILE_DIR = os.environ.get('SOUPBOT_PROFILE_DIR', PROFILE_DIR)
     for envvar in os.environ:
         if envvar.startswith('SOUPBOT_CUSTOM_'):
             CUSTOM["$" + envvar[len('SOUPBOT_CUSTOM_'):].lower()] = os.environ[envvar]
@@ -0,0 +1,79 @@
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+
+# Score-ordered index of the dinkdonk counts in a server, kept up to date as counts change.
+# Users with the same count are ordered by user ID, same as the rows that utils.rank_dinkdonks receives from the DB.
+class ServerLeaderboard:
+  def __init__(self, rows: List[Tuple[Hashable, int]] = ()):
+    self._counts: Dict[Hashable, int] = {}
+    self._entries = SortedList()
+    # Distinct scores, and how many users share each of them
+    self._scores = SortedList()
+    self._score_sizes: Dict[int, int] = {}
+    # (user_id, count) of the user with the highest count; ties go to the last user ID, like db.check_if_has_reset_privilege always did
+    self.champion: Optional[Tuple[Hashable, int]] = None
+    for (user_id, count) in rows:
+      self.set_count(user_id, count)
+
+  def __len__(self):
+    return len(self._counts)
+
+  def get_count(self, user_id: Hashable) -> int:
+    return self._counts.get(user_id, 0)
+
+  def set_count(self, user_id: Hashable, count: int):
+    old_count = self._counts.pop(user_id, 0)
+    if old_count > 0:
+      self._entries.remove((-old_count, user_id))
+      self._score_sizes[old_count] -= 1
+      if not self._score_sizes[old_count]:
+        del self._score_sizes[old_count]
+        self._scores.remove(old_count)
+    if count > 0:
+      self._counts[user_id] = count
+      self._entries.add((-count, user_id))
+      if count not in self._score_sizes:
+        self._score_sizes[count] = 0
+        self._scores.add(count)
+      self._score_sizes[count] += 1
+    champion = self.champion
+    if count > 0 and (champion is None or (count, user_id) >= (champion[1], champion[0])):
+      self.champion = (user_id, count)
+    elif champion is not None and champion[0] == user_id:
+      self._update_champion()
+
+  def _update_champion(self):
+    if not self._scores:
+      self.champion = None
+      return
+    max_count = self._scores[-1]
+    (_, user_id) = self._entries[self._score_sizes[max_count] - 1]
+    self.champion = (user_id, max_count)
+
+  def clear(self):
+    self._counts.clear()
+    self._entries.clear()
+    self._scores.clear()
+    self._score_sizes.clear()
+    self.champion = None
+
+  # Same output as utils.rank_dinkdonks(rows, cut_off_at_length=cut_off_at_length)
+  def rank(self, cut_off_at_length: Optional[int] = None) -> List[Tuple[int, List[Hashable]]]:
+    ranked_list = []
+    for (negative_count, user_id) in self._entries:
+      if ranked_list and ranked_list[-1][0] == -negative_count:
+        ranked_list[-1][1].append(user_id)
+      else:
+        if cut_off_at_length and len(ranked_list) >= cut_off_at_length:
+          break
+        ranked_list.append((-negative_count, [user_id]))
+    return ranked_list
+
+  # Same as len(utils.rank_dinkdonks(rows, cut_off_at_user_id=user_id)), or None if the user has no dinkdonks
+  def place_of(self, user_id: Hashable) -> Optional[int]:
+    count = self._counts.get(user_id)
+    if not count:
+      return None
+    return len(self._scores) - self._scores.bisect_right(count) + 1
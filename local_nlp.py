@@ -0,0 +1,195 @@
+import datetime
+import re
+from typing import List, Optional, Tuple
+
+import dateutil.parser
+import dateutil.relativedelta
+
+# Offline parser for the most common, unambiguous time expressions ("at 9pm", "tomorrow", "on 2024-05-03", "friday 3-5pm").
+# It returns the same document structure as Wit.message, so that nlp.process_time_message can consume it unchanged, and None
+# whenever any part of the message isn't understood, in which case the message should be sent to Wit instead.
+
+ENT_DATETIME_KEY = 'wit$datetime:datetime'
+# Number of candidate values to return for underspecified expressions (e.g. "9pm" or "friday"), like Wit does
+NUM_CANDIDATES = 3
+
+_WEEKDAYS = {
+  'monday': 0, 'mon': 0,
+  'tuesday': 1, 'tues': 1, 'tue': 1,
+  'wednesday': 2, 'wed': 2,
+  'thursday': 3, 'thurs': 3, 'thur': 3, 'thu': 3,
+  'friday': 4, 'fri': 4,
+  'saturday': 5, 'sat': 5,
+  'sunday': 6, 'sun': 6,
+}
+_RELATIVE_DAYS = {'today': 0, 'tomorrow': 1, 'tmrw': 1, 'tmr': 1, 'yesterday': -1}
+_MONTHS = 'january|february|march|april|may|june|july|august|september|october|november|december|jan|feb|mar|apr|jun|jul|aug|sept|sep|oct|nov|dec'
+_END = r'(?=[\s,]|$)'
+
+_FILLER_RE = re.compile(r'(?:(?:at|on|by|around|from)' + _END + r'|@|,)\s*')
+_DATE_RE = re.compile(
+  r'(?:(?P<relative>' + '|'.join(_RELATIVE_DAYS) + r')'
+  r'|(?P<weekday>' + '|'.join(sorted(_WEEKDAYS, key=len, reverse=True)) + r')'
+  r'|(?P<iso>\d{4}-\d{2}-\d{2})'
+  r'|(?P<month_day>(?:' + _MONTHS + r')\.?\s+\d{1,2}(?:st|nd|rd|th)?(?P<year1>,?\s+\d{4})?)'
+  r'|(?P<day_month>\d{1,2}(?:st|nd|rd|th)?\s+(?:of\s+)?(?:' + _MONTHS + r')(?P<year2>,?\s+\d{4})?)'
+  r')' + _END + r'\s*'
+)
+_MERIDIEM = r'(?:\s*(?P<{}>[ap])\.?m\.?)'
+_TIME_RE = re.compile(
+  r'(?:(?P<noon>noon)'
+  r'|(?P<h1>\d{1,2})(?::(?P<m1>\d{2}))?' + _MERIDIEM.format('ap1') + r'?'
+  r'(?:\s*(?:-|–|to|until|till)\s*(?P<h2>\d{1,2})(?::(?P<m2>\d{2}))?' + _MERIDIEM.format('ap2') + r'?)?'
+  r')' + _END + r'\s*'
+)
+
+stats = {'local': 0, 'fallback': 0}
+
+
+def local_ratio() -> float:
+  total = stats['local'] + stats['fallback']
+  return stats['local'] / total if total else 0.0
+
+def _to_24h(hour: int, meridiem: Optional[str]) -> Optional[int]:
+  if meridiem is None:
+    # Only accept unambiguous 24-hour times without AM/PM
+    return hour if hour == 0 or 13 <= hour <= 23 else None
+  if not 1 <= hour <= 12:
+    return None
+  return hour % 12 + (12 if meridiem == 'p' else 0)
+
+def _parse_time(match: re.Match) -> Optional[Tuple[Tuple[int, int], Optional[Tuple[int, int]], str]]:
+  if match.group('noon'):
+    return ((12, 0), None, 'hour')
+  m1 = int(match.group('m1') or 0)
+  ap1 = match.group('ap1')
+  if match.group('h2') is None:
+    if ap1 is None and match.group('m1') is None:
+      return None
+    hour = _to_24h(int(match.group('h1')), ap1)
+    if hour is None or m1 >= 60:
+      return None
+    return ((hour, m1), None, 'minute' if match.group('m1') else 'hour')
+  m2 = int(match.group('m2') or 0)
+  ap2 = match.group('ap2')
+  if m1 >= 60 or m2 >= 60 or (ap1 is None and ap2 is None):
+    return None
+  h1, h2 = int(match.group('h1')), int(match.group('h2'))
+  # "3-5pm" and "11-1pm" borrow the meridiem from the other end of the range
+  if ap1 is None:
+    ap1 = ap2
+    if ap2 == 'p' and _to_24h(h1, 'p') is not None and (_to_24h(h1, 'p'), m1) > (_to_24h(h2, 'p'), m2):
+      ap1 = 'a'
+  elif ap2 is None:
+    ap2 = ap1
+    if ap1 == 'a' and _to_24h(h2, 'a') is not None and (_to_24h(h2, 'a'), m2) < (_to_24h(h1, 'a'), m1):
+      ap2 = 'p'
+  start, end = _to_24h(h1, ap1), _to_24h(h2, ap2)
+  if start is None or end is None:
+    return None
+  grain = 'minute' if match.group('m1') or match.group('m2') else 'hour'
+  return ((start, m1), (end, m2), grain)
+
+def _parse_date(match: re.Match, today: datetime.date) -> Optional[List[datetime.date]]:
+  if match.group('relative'):
+    return [today + datetime.timedelta(days=_RELATIVE_DAYS[match.group('relative')])]
+  if match.group('weekday'):
+    weekday = _WEEKDAYS[match.group('weekday')]
+    # Whether the current weekday means today or next week is ambiguous, so leave that to Wit
+    if weekday == today.weekday():
+      return None
+    first = today + dateutil.relativedelta.relativedelta(weekday=weekday)
+    return [first + datetime.timedelta(weeks=i) for i in range(NUM_CANDIDATES)]
+  if match.group('iso'):
+    try:
+      return [datetime.date.fromisoformat(match.group('iso'))]
+    except ValueError:
+      return None
+  text = match.group('month_day') or match.group('day_month')
+  try:
+    value = dateutil.parser.parse(text, default=datetime.datetime(today.year, 1, 1)).date()
+  except (ValueError, OverflowError):
+    return None
+  if match.group('year1') or match.group('year2'):
+    return [value]
+  # Without a year, the next occurrences are the candidates
+  first_year = value.year + 1 if value < today else value.year
+  try:
+    return [value.replace(year=first_year + i) for i in range(NUM_CANDIDATES)]
+  except ValueError:
+    # February 29th
+    return None
+
+def _combine(date: datetime.date, hour_minute: Tuple[int, int], tzinfo) -> datetime.datetime:
+  return datetime.datetime.combine(date, datetime.time(*hour_minute), tzinfo=tzinfo)
+
+def _value(dt: datetime.datetime, grain: str) -> dict:
+  return {'value': dt.isoformat(), 'grain': grain}
+
+def _parse(message: str, reference_time: datetime.datetime) -> Optional[dict]:
+  body = message.strip().rstrip('.!?').strip()
+  text = ' '.join(body.lower().split())
+  if not text:
+    return None
+
+  date_values = time_value = None
+  pos = 0
+  while pos < len(text):
+    filler = _FILLER_RE.match(text, pos)
+    if filler:
+      pos = filler.end()
+      continue
+    date_match = _DATE_RE.match(text, pos) if date_values is None else None
+    if date_match:
+      date_values = _parse_date(date_match, reference_time.date())
+      if date_values is None:
+        return None
+      pos = date_match.end()
+      continue
+    time_match = _TIME_RE.match(text, pos) if time_value is None else None
+    if time_match:
+      time_value = _parse_time(time_match)
+      if time_value is None:
+        return None
+      pos = time_match.end()
+      continue
+    return None
+  if date_values is None and time_value is None:
+    return None
+
+  tz = reference_time.tzinfo
+  if time_value is None:
+    values = [{'type': 'value', **_value(_combine(date, (0, 0), tz), 'day')} for date in date_values]
+    entity = {'type': 'value', 'grain': 'day'}
+  else:
+    (start, end, grain) = time_value
+    if date_values is None:
+      # A time by itself refers to its next occurrence
+      first_date = reference_time.date()
+      if _combine(first_date, start, tz) < reference_time:
+        first_date += datetime.timedelta(days=1)
+      date_values = [first_date + datetime.timedelta(days=i) for i in range(NUM_CANDIDATES)]
+    if end is None:
+      values = [{'type': 'value', **_value(_combine(date, start, tz), grain)} for date in date_values]
+      entity = {'type': 'value', 'grain': grain}
+    else:
+      # Like Wit, the end of an interval is exclusive
+      step = datetime.timedelta(hours=1) if grain == 'hour' else datetime.timedelta(minutes=1)
+      values = []
+      for date in date_values:
+        datetime_from = _combine(date, start, tz)
+        datetime_to = _combine(date, end, tz)
+        if datetime_to <= datetime_from:
+          datetime_to += datetime.timedelta(days=1)
+        values.append({'type': 'interval', 'from': _value(datetime_from, grain), 'to': _value(datetime_to + step, grain)})
+      entity = {'type': 'interval', 'from': values[0]['from'], 'to': values[0]['to']}
+  if entity['type'] == 'value':
+    entity['value'] = values[0]['value']
+  entity['body'] = body
+  entity['values'] = values
+  return {'text': message, 'entities': {ENT_DATETIME_KEY: [entity]}}
+
+def parse(message: str, reference_time: datetime.datetime) -> Optional[dict]:
+  doc = _parse(message, reference_time)
+  stats['local' if doc else 'fallback'] += 1
+  return doc
@@ -1,13 +1,80 @@
+import argparse
+import logging as pyLogging
+import multiprocessing
+import signal
+
 import db
+import db_async
 import env
 import nlp
 import discord_bot
 
-def main():
+logging = pyLogging.getLogger('soupbot.main')
+
+
+def worker(index, shard_ids, shard_count, process_count):
   env.init_env()
+  env.SHARD_COUNT = shard_count
+  env.PROCESS_COUNT = process_count
+  # Each worker serves its own metrics, on consecutive ports
+  if env.METRICS_PORT is not None:
+    env.METRICS_PORT += index
   nlp.init()
-  db.init()
-  discord_bot.run()
+  db_async.init()
+  discord_bot.run(shard_ids, shard_count)
+
+# Splits shards 0..shard_count-1 into contiguous ranges, one per process
+def split_shards(shard_count, process_count):
+  (size, extra) = divmod(shard_count, process_count)
+  ranges = []
+  start = 0
+  for i in range(process_count):
+    end = start + size + (1 if i < extra else 0)
+    ranges.append(list(range(start, end)))
+    start = end
+  return ranges
+
+def main():
+  env.init_env()
+  parser = argparse.ArgumentParser(description='Run SoupBot.')
+  parser.add_argument('--shards', type=int, default=env.SHARD_COUNT, help='total number of shards (default: unsharded, or one per process)')
+  parser.add_argument('--processes', type=int, default=env.PROCESS_COUNT, help='number of worker processes, each owning a range of shards (default: %(default)s)')
+  args = parser.parse_args()
+  if args.processes < 1:
+    parser.error('--processes must be at least 1')
+  if args.processes > 1 and args.shards is None:
+    args.shards = args.processes
+  if args.shards is not None and args.shards < args.processes:
+    parser.error('--shards must be at least --processes')
+
+  if args.processes == 1:
+    nlp.init()
+    db_async.init()
+    discord_bot.run(None, args.shards)
+    return
+
+  # Every guild belongs to a single shard, so per-guild state (cooldowns, leaderboards, member indexes) stays local to one
+  # worker; the workers only share the SQLite database. Migrate it here once, instead of racing to do it in every worker.
+  pyLogging.basicConfig(level=pyLogging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+  db.init(env.DB_PATH)
+  db.close()
+  context = multiprocessing.get_context('spawn')
+  processes = []
+  for (index, shard_ids) in enumerate(split_shards(args.shards, args.processes)):
+    process = context.Process(target=worker, args=(index, shard_ids, args.shards, args.processes), name=f'soupbot-shards-{shard_ids[0]}-{shard_ids[-1]}')
+    process.start()
+    logging.info('Started %s (pid %d)', process.name, process.pid)
+    processes.append(process)
+
+  def stop(signum, frame):
+    for process in processes:
+      if process.is_alive():
+        process.terminate()
+  signal.signal(signal.SIGINT, stop)
+  signal.signal(signal.SIGTERM, stop)
+  for process in processes:
+    process.join()
+    logging.info('%s exited with code %s', process.name, process.exitcode)
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,128 @@
+import random
+import time
+from typing import Dict, List, Optional
+
+import discord
+
+import cache
+
+# Index of the non-bot members that can see each channel, so that $dinkdonk can pick one at random without scanning every
+# member of the guild. Channels are indexed lazily on first use, and then kept up to date from gateway events; changes that
+# could affect many members at once (role or permission overwrite edits) simply drop the affected channels from the index.
+# When members aren't cached (see env.MEMBER_CACHE), channels are indexed from an uncached, on-demand guild chunk instead,
+# and rebuilt after a while, since member updates aren't delivered for members that aren't cached.
+
+
+class _MemberSet:
+  """Set of members supporting O(1) insertion, removal and random choice."""
+
+  def __init__(self, members=()):
+    self._members: List[discord.Member] = []
+    self._positions: Dict[int, int] = {}
+    for member in members:
+      self.add(member)
+
+  def __len__(self):
+    return len(self._members)
+
+  def __contains__(self, member_id: int):
+    return member_id in self._positions
+
+  def add(self, member: discord.Member):
+    position = self._positions.get(member.id)
+    if position is None:
+      self._positions[member.id] = len(self._members)
+      self._members.append(member)
+    else:
+      # Keep the most recent object for the member, since it's the one with up-to-date names and avatars
+      self._members[position] = member
+
+  def discard(self, member_id: int):
+    position = self._positions.pop(member_id, None)
+    if position is None:
+      return
+    last = self._members.pop()
+    if position < len(self._members):
+      self._members[position] = last
+      self._positions[last.id] = position
+
+  def choice(self, rng: random.Random) -> discord.Member:
+    return self._members[rng.randrange(len(self._members))]
+
+
+def _is_eligible(channel, member: discord.Member) -> bool:
+  return not member.bot and channel.permissions_for(member).read_messages
+
+
+class ChannelMemberIndex:
+  def __init__(self, lazy_chunk: bool = False, ttl: Optional[float] = None):
+    self.lazy_chunk = lazy_chunk
+    self.ttl = ttl
+    # Guild ID -> channel ID -> (channel, eligible members, expiry time)
+    self._guilds: Dict[int, Dict[int, tuple]] = {}
+    self._chunks = cache.SingleFlight()
+    self.stats = {'builds': 0, 'invalidations': 0, 'chunks': 0}
+
+  def _get(self, channel) -> Optional[_MemberSet]:
+    entry = self._guilds.get(channel.guild.id, {}).get(channel.id)
+    if entry is None or (entry[2] is not None and entry[2] <= time.monotonic()):
+      return None
+    return entry[1]
+
+  def _store(self, channel, members: _MemberSet):
+    self.stats['builds'] += 1
+    expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+    self._guilds.setdefault(channel.guild.id, {})[channel.id] = (channel, members, expires_at)
+
+  async def _chunk(self, guild: discord.Guild) -> List[discord.Member]:
+    self.stats['chunks'] += 1
+    return await guild.chunk(cache=False)
+
+  # Must be awaited before count() or pick(), so that the channel is indexed
+  async def load(self, channel):
+    if self._get(channel) is not None:
+      return
+    if self.lazy_chunk:
+      # Concurrent loads for channels in the same guild share a single chunk request
+      guild_members = await self._chunks.do(channel.guild.id, lambda: self._chunk(channel.guild))
+      self._store(channel, _MemberSet(m for m in guild_members if _is_eligible(channel, m)))
+    else:
+      self._store(channel, _MemberSet(m for m in channel.members if not m.bot))
+
+  def count(self, channel) -> int:
+    return len(self._get(channel) or ())
+
+  def pick(self, channel, rng: random.Random) -> Optional[discord.Member]:
+    members = self._get(channel)
+    if not members:
+      return None
+    return members.choice(rng)
+
+  # Event handlers
+
+  def member_joined(self, member: discord.Member):
+    for (channel, members, _) in self._guilds.get(member.guild.id, {}).values():
+      if _is_eligible(channel, member):
+        members.add(member)
+
+  def member_removed(self, guild_id: int, user_id: int):
+    for (_, members, _) in self._guilds.get(guild_id, {}).values():
+      members.discard(user_id)
+
+  def member_updated(self, before: discord.Member, after: discord.Member):
+    for (channel, members, _) in self._guilds.get(after.guild.id, {}).values():
+      if _is_eligible(channel, after):
+        members.add(after)
+      else:
+        members.discard(after.id)
+
+  def cached_member_count(self) -> int:
+    return sum(len(members) for channels in self._guilds.values() for (_, members, _) in channels.values())
+
+  def invalidate_guild(self, guild_id: int):
+    if self._guilds.pop(guild_id, None) is not None:
+      self.stats['invalidations'] += 1
+
+  def invalidate_channel(self, guild_id: int, channel_id: int):
+    if self._guilds.get(guild_id, {}).pop(channel_id, None) is not None:
+      self.stats['invalidations'] += 1
@@ -0,0 +1,131 @@
+import bisect
+import logging as pyLogging
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+import local_nlp
+
+# Per-command counters and latency histograms, served in the Prometheus text format from a local HTTP endpoint.
+
+logging = pyLogging.getLogger('soupbot.metrics')
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+  """Cumulative histogram with fixed bucket bounds, like a Prometheus histogram."""
+
+  def __init__(self, bounds=LATENCY_BUCKETS):
+    self.bounds = bounds
+    # The last bucket is +Inf
+    self.counts = [0] * (len(bounds) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value: float):
+    self.counts[bisect.bisect_left(self.bounds, value)] += 1
+    self.sum += value
+    self.count += 1
+
+
+class CommandStats:
+  __slots__ = ('invocations', 'errors', 'latency')
+
+  def __init__(self):
+    self.invocations = 0
+    self.errors = 0
+    self.latency = Histogram()
+
+
+commands: Dict[str, CommandStats] = {}
+# (command, stage) -> latency histogram, recorded by tracing
+stages: Dict[Tuple[str, str], Histogram] = {}
+messages = 0
+_runner: Optional[web.AppRunner] = None
+
+
+def _get(command: str) -> CommandStats:
+  stats = commands.get(command)
+  if stats is None:
+    stats = commands[command] = CommandStats()
+  return stats
+
+def record_message():
+  global messages
+  messages += 1
+
+def record_command(command: str, seconds: float):
+  stats = _get(command)
+  stats.invocations += 1
+  stats.latency.observe(seconds)
+
+def record_error(command: str):
+  _get(command).errors += 1
+
+def record_stage(command: str, stage: str, seconds: float):
+  histogram = stages.get((command, stage))
+  if histogram is None:
+    histogram = stages[(command, stage)] = Histogram()
+  histogram.observe(seconds)
+
+def _escape(value: str) -> str:
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render() -> str:
+  lines: List[str] = [
+    '# HELP soupbot_messages_total Messages seen, including non-commands.',
+    '# TYPE soupbot_messages_total counter',
+    f'soupbot_messages_total {messages}',
+    '# HELP soupbot_command_invocations_total Commands handled.',
+    '# TYPE soupbot_command_invocations_total counter',
+  ]
+  for (command, stats) in commands.items():
+    lines.append(f'soupbot_command_invocations_total{{command="{_escape(command)}"}} {stats.invocations}')
+  lines.append('# HELP soupbot_command_errors_total Commands that failed with an error.')
+  lines.append('# TYPE soupbot_command_errors_total counter')
+  for (command, stats) in commands.items():
+    lines.append(f'soupbot_command_errors_total{{command="{_escape(command)}"}} {stats.errors}')
+  lines.append('# HELP soupbot_command_latency_seconds Time spent handling each command.')
+  lines.append('# TYPE soupbot_command_latency_seconds histogram')
+  for (command, stats) in commands.items():
+    _render_histogram(lines, 'soupbot_command_latency_seconds', f'command="{_escape(command)}"', stats.latency)
+  lines.append('# HELP soupbot_local_nlp_parses_total Time messages parsed locally, or sent to Wit.AI because the local parser gave up.')
+  lines.append('# TYPE soupbot_local_nlp_parses_total counter')
+  for (result, count) in local_nlp.stats.items():
+    lines.append(f'soupbot_local_nlp_parses_total{{result="{result}"}} {count}')
+  if stages:
+    lines.append('# HELP soupbot_stage_latency_seconds Time spent in each stage of a command, when tracing is enabled.')
+    lines.append('# TYPE soupbot_stage_latency_seconds histogram')
+    for ((command, stage), histogram) in stages.items():
+      _render_histogram(lines, 'soupbot_stage_latency_seconds', f'command="{_escape(command)}",stage="{_escape(stage)}"', histogram)
+  return '\n'.join(lines) + '\n'
+
+def _render_histogram(lines: List[str], name: str, label: str, histogram: Histogram):
+  cumulative = 0
+  for (bound, count) in zip(histogram.bounds + (float('inf'),), histogram.counts):
+    cumulative += count
+    le = '+Inf' if bound == float('inf') else repr(bound)
+    lines.append(f'{name}_bucket{{{label},le="{le}"}} {cumulative}')
+  lines.append(f'{name}_sum{{{label}}} {histogram.sum}')
+  lines.append(f'{name}_count{{{label}}} {histogram.count}')
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+  return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+async def start(port: int, host: str = '127.0.0.1'):
+  global _runner
+  app = web.Application()
+  app.router.add_get('/metrics', _handle_metrics)
+  _runner = web.AppRunner(app, access_log=None)
+  await _runner.setup()
+  await web.TCPSite(_runner, host, port).start()
+  logging.info('Serving metrics on http://%s:%d/metrics', host, port)
+
+async def close():
+  global _runner
+  if _runner:
+    await _runner.cleanup()
+    _runner = None
+
@@ -0,0 +1,43 @@
+import argparse
+import logging as pyLogging
+import os
+import sqlite3
+import sys
+
+import db
+
+logging = pyLogging.getLogger('soupbot.migrate')
+
+
+# Offline converter for existing databases: backs up the file, applies any pending migrations and compacts the result.
+# The bot also applies migrations on startup, but converting beforehand keeps the deploy itself fast.
+def main():
+  pyLogging.basicConfig(level=pyLogging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+  parser = argparse.ArgumentParser(description='Migrate a SoupBot database to the latest schema.')
+  parser.add_argument('path', nargs='?', default='discord_bot.db', help='path to the SQLite database (default: %(default)s)')
+  parser.add_argument('--no-backup', action='store_true', help='don\'t create a backup copy before migrating')
+  args = parser.parse_args()
+
+  if not os.path.exists(args.path):
+    logging.error('Database "%s" not found', args.path)
+    sys.exit(1)
+
+  conn = sqlite3.connect(args.path)
+  version = conn.execute('PRAGMA user_version').fetchone()[0]
+  if version >= len(db.MIGRATIONS):
+    logging.info('Database "%s" is already at the latest version (%d)', args.path, version)
+    return
+  if not args.no_backup:
+    backup_path = f'{args.path}.v{version}.bak'
+    backup = sqlite3.connect(backup_path)
+    conn.backup(backup)
+    backup.close()
+    logging.info('Backed up database to "%s"', backup_path)
+  size_before = os.path.getsize(args.path)
+  db.migrate(conn)
+  conn.execute('VACUUM')
+  conn.close()
+  logging.info('Migrated "%s" from version %d to %d (%d -> %d bytes)', args.path, version, len(db.MIGRATIONS), size_before, os.path.getsize(args.path))
+
+if __name__ == '__main__':
+  main()
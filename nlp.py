@@ -1,18 +1,106 @@
 import aiohttp
+import asyncio
 import datetime
+import dateutil.relativedelta
+import email.utils
 import json
 import logging as pyLogging
+import random
+import re
+import time
 import traceback
+from typing import List, Optional
 
+import breaker
+import cache
+import db_async
 import env
-import utils
+import local_nlp
+import tracing
 
 logging = pyLogging.getLogger('soupbot.nlp')
 wit = None
+doc_cache = None
+in_flight = None
+_prune_task = None
+disk_cache_stats = {'hits': 0, 'misses': 0, 'stores': 0}
+
+# Raised without contacting Wit, when it's been failing or too many requests are already waiting on it
+class WitUnavailableError(Exception):
+  pass
+
+
+# Raised for 429 and 5xx responses, which are worth retrying
+class WitRetryableError(ValueError):
+  def __init__(self, status: int, retry_after: Optional[float]):
+    super().__init__(f'Received HTTP status {status}')
+    self.status = status
+    self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+  if not value:
+    return None
+  try:
+    return max(0.0, float(value))
+  except ValueError:
+    pass
+  # Retry-After can also be an HTTP date
+  try:
+    retry_at = email.utils.parsedate_to_datetime(value)
+  except (TypeError, ValueError):
+    return None
+  return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
 
 class Wit:
-  def __init__(self, token: str):
+  def __init__(self, token: str, connection_limit: int = 10, keepalive_timeout: float = 30, url: str = 'https://api.wit.ai/message',
+      max_concurrency: int = 10, timeout: float = 10, max_retries: int = 2, retry_base_delay: float = 0.25, max_retry_delay: float = 5,
+      breaker_threshold: int = 5, breaker_reset_timeout: float = 30):
     self.token = token
+    self.url = url
+    self.connection_limit = connection_limit
+    self.keepalive_timeout = keepalive_timeout
+    self.max_concurrency = max_concurrency
+    self.timeout = timeout
+    self.max_retries = max_retries
+    self.retry_base_delay = retry_base_delay
+    self.max_retry_delay = max_retry_delay
+    self.breaker = breaker.CircuitBreaker(breaker_threshold, breaker_reset_timeout)
+    self.session = None
+    self.semaphore = None
+    self.stats = {'requests': 0, 'connections_created': 0, 'connections_reused': 0, 'retries': 0, 'failures': 0, 'queue_timeouts': 0}
+
+  async def _on_connection_create_end(self, session, trace_config_ctx, params):
+    self.stats['connections_created'] += 1
+
+  async def _on_connection_reuseconn(self, session, trace_config_ctx, params):
+    self.stats['connections_reused'] += 1
+
+  async def open(self):
+    if self.session and not self.session.closed:
+      return
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(self._on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+    connector = aiohttp.TCPConnector(limit=self.connection_limit, keepalive_timeout=self.keepalive_timeout)
+    # Created here rather than in __init__, so that it's bound to the running event loop
+    self.semaphore = asyncio.Semaphore(self.max_concurrency)
+    self.session = aiohttp.ClientSession(
+      connector=connector,
+      timeout=aiohttp.ClientTimeout(total=self.timeout),
+      trace_configs=[trace_config],
+      headers={
+        'Authorization': f'Bearer {self.token}',
+        'Accept': 'application/json'
+      },
+    )
+
+  async def close(self):
+    if self.session and not self.session.closed:
+      await self.session.close()
+    self.session = None
+    logging.info('Closed Wit session (stats: %s, circuit breaker: %s)', self.stats, self.breaker.stats)
 
   async def message(self, msg: str, reference_time: datetime.datetime):
     params = {
@@ -20,34 +108,254 @@ class Wit:
       'q': msg[:280],
       'context': json.dumps({'reference_time': reference_time.replace(microsecond=0).isoformat()}), 
     }
-    headers = {
-      'Authorization': f'Bearer {self.token}',
-      'Accept': 'application/json'
-    }
-    async with aiohttp.ClientSession() as session:
-      async with session.get('https://api.wit.ai/message', params=params, headers=headers) as r:
+    # Lazily open the pooled session, in case start() hasn't been called yet
+    if not self.session or self.session.closed:
+      await self.open()
+    # The breaker gets one outcome per request, however many attempts it takes
+    if not self.breaker.allow():
+      raise WitUnavailableError(f'Wit is unavailable, retrying in {self.breaker.retry_in():.1f}s')
+    attempt = 0
+    reported = False
+    try:
+      while True:
+        try:
+          json_body = await self._request(params)
+        except (WitRetryableError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+          self.stats['failures'] += 1
+          retry_after = e.retry_after if isinstance(e, WitRetryableError) else None
+          # Stop early if other requests have opened the breaker in the meantime
+          if attempt >= self.max_retries or (retry_after is not None and retry_after > self.max_retry_delay) or self.breaker.state == breaker.OPEN:
+            reported = True
+            self.breaker.record_failure()
+            raise
+          # Full jitter, so that callers failing together don't all retry together; Retry-After is a lower bound
+          delay = random.uniform(0, min(self.max_retry_delay, self.retry_base_delay * 2 ** attempt))
+          if retry_after is not None:
+            delay += retry_after
+          attempt += 1
+          self.stats['retries'] += 1
+          logging.warning('Wit request failed (%s), retrying in %.2fs (attempt %d of %d)', e, delay, attempt, self.max_retries)
+          await asyncio.sleep(delay)
+          continue
+        except ValueError:
+          # Wit answered, even if it rejected the request
+          reported = True
+          self.breaker.record_success()
+          raise
+        reported = True
+        self.breaker.record_success()
+        return json_body
+    finally:
+      if not reported:
+        # Queue timeouts and cancellations say nothing about Wit, so let another call take the trial
+        self.breaker.release()
+
+  async def _request(self, params: dict) -> dict:
+    # Bound the number of requests in flight, and fail fast instead of queueing indefinitely behind them
+    try:
+      await asyncio.wait_for(self.semaphore.acquire(), self.timeout)
+    except asyncio.TimeoutError:
+      self.stats['queue_timeouts'] += 1
+      raise WitUnavailableError('Too many pending requests to Wit')
+    try:
+      self.stats['requests'] += 1
+      async with self.session.get(self.url, params=params) as r:
+        if r.status == 429 or r.status >= 500:
+          raise WitRetryableError(r.status, parse_retry_after(r.headers.get('Retry-After')))
         if r.status != 200:
           raise ValueError(f'Received HTTP status {r.status}')
         json_body = await r.json()
         if 'error' in json_body:
-          raise ValueError(f'Received error in response: {r.dumps(json_body["error"])}')
+          raise ValueError(f'Received error in response: {json.dumps(json_body["error"])}')
         return json_body
+    finally:
+      self.semaphore.release()
 
 ENT_DATETIME_KEY = 'wit$datetime:datetime'
 ENT_GRAIN_DATE = {'day'}
 ENT_GRAIN_TIME = {'hour', 'minute', 'second'}
 ENT_GRAIN_DATETIME = ENT_GRAIN_DATE | ENT_GRAIN_TIME
+# Grains that span several days; only accepted when explicitly requested, and then converted to ranges of days
+ENT_GRAIN_RANGE = {'week', 'month'}
+ENT_GRAIN_DATE_RANGE = ENT_GRAIN_DATE | ENT_GRAIN_RANGE
+# Wit's interval ends are exclusive, so one unit of the grain is subtracted before displaying them
+ENT_GRAIN_TIMEDELTA = {
+  'day': datetime.timedelta(days=1),
+  'hour': datetime.timedelta(hours=1),
+  'minute': datetime.timedelta(minutes=1),
+  'second': datetime.timedelta(seconds=1),
+  'week': datetime.timedelta(weeks=1),
+  'month': dateutil.relativedelta.relativedelta(months=1),
+}
+ONE_SECOND = datetime.timedelta(seconds=1)
 
 
 class ProcessTimeMessageException(ValueError):
   pass
 
 
+# A single parsed time, as epoch seconds. Intervals have an inclusive end; single values have end set to None.
+# style is the Discord timestamp style (':D', ':f' or ':t') that the value should be rendered with.
+class TimeValue:
+  __slots__ = ('start', 'end', 'style')
+
+  def __init__(self, start: int, end: Optional[int], style: str):
+    self.start = start
+    self.end = end
+    self.style = style
+
+  def __repr__(self):
+    return f'TimeValue({self.start!r}, {self.end!r}, {self.style!r})'
+
+  def render(self) -> str:
+    if self.end is None:
+      return f'<t:{self.start}{self.style}>'
+    return f'<t:{self.start}{self.style}> to <t:{self.end}{self.style}>'
+
+
+# All candidate values for one time expression found in a message
+class TimeResult:
+  __slots__ = ('body', 'grain', 'values')
+
+  def __init__(self, body: str, grain: str, values: List[TimeValue]):
+    self.body = body
+    self.grain = grain
+    self.values = values
+
+  def __repr__(self):
+    return f'TimeResult({self.body!r}, {self.grain!r}, {self.values!r})'
+
+
 def init():
-  global wit
-  wit = Wit(env.WIT_TOKEN)
+  global wit, doc_cache, in_flight
+  wit = Wit(
+    env.WIT_TOKEN,
+    connection_limit=env.WIT_CONNECTION_LIMIT,
+    keepalive_timeout=env.WIT_KEEPALIVE_TIMEOUT,
+    url=env.WIT_URL,
+    max_concurrency=env.WIT_MAX_CONCURRENCY,
+    timeout=env.WIT_TIMEOUT,
+    max_retries=env.WIT_MAX_RETRIES,
+    breaker_threshold=env.WIT_BREAKER_THRESHOLD,
+    breaker_reset_timeout=env.WIT_BREAKER_RESET_TIMEOUT,
+  )
+  doc_cache = cache.LRUCache(env.NLP_CACHE_SIZE, ttl=env.NLP_CACHE_TTL)
+  in_flight = cache.SingleFlight()
+
+async def start():
+  global _prune_task
+  if not wit:
+    raise ValueError('NLP not initialized!')
+  await wit.open()
+  if env.NLP_DISK_CACHE:
+    _prune_task = asyncio.ensure_future(_prune_disk_cache())
+
+async def close():
+  global _prune_task
+  if _prune_task:
+    _prune_task.cancel()
+    _prune_task = None
+  if wit:
+    await wit.close()
+  if doc_cache:
+    logging.info('NLP cache stats: %s, in-flight stats: %s', doc_cache.stats, in_flight.stats)
+  if env.NLP_DISK_CACHE:
+    logging.info('NLP disk cache stats: %s', disk_cache_stats)
+  if env.LOCAL_NLP:
+    logging.info('Local parser stats: %s (%.1f%% handled locally)', local_nlp.stats, local_nlp.local_ratio() * 100)
+
+def normalize_query(message: str) -> str:
+  return ' '.join(message[:280].casefold().split())
+
+def query_key(message: str, local_datetime_with_tz: datetime.datetime):
+  # Relative phrases ("tomorrow", "in 2 hours") are only valid around the reference time, so it's bucketed into the key
+  text = normalize_query(message)
+  bucket = int(local_datetime_with_tz.timestamp()) // env.NLP_CACHE_BUCKET_SECONDS
+  return (text, local_datetime_with_tz.tzname(), local_datetime_with_tz.utcoffset(), bucket)
+
+async def fetch_doc(message: str, local_datetime_with_tz: datetime.datetime):
+  key = query_key(message, local_datetime_with_tz)
+  doc = doc_cache.get(key)
+  if doc is not None:
+    return doc
+
+  async def fetch():
+    doc = await get_persisted_doc(message, local_datetime_with_tz) if env.NLP_DISK_CACHE else None
+    if doc is None:
+      doc = await wit.message(message, local_datetime_with_tz)
+      if env.NLP_DISK_CACHE and 'entities' in doc:
+        await persist_doc(message, local_datetime_with_tz, doc)
+    if 'entities' in doc:
+      doc_cache.set(key, doc)
+    return doc
+
+  # Identical concurrent queries share a single request to Wit
+  with tracing.span('nlp.wit'):
+    return await in_flight.do(key, fetch)
+
+# Only queries that don't depend on the reference time are persisted, i.e. nothing relative to the current time ("in 2
+# hours", "now"), day ("tomorrow", "tonight", "friday") or week/month/year ("next week", "this weekend"). Their answer
+# doesn't change until its first value has passed, e.g. "may 3rd at 6pm" is the same until then.
+_RELATIVE_RE = re.compile(
+  r'\b(?:now|ago|later|earlier|hence|from now|soon'
+  r'|in (?:a|an|a few|few|a couple|couple|half|\d{1,3}(?:\.\d+)?|one|two|three|four|five|six|seven|eight|nine|ten|fifteen|twenty|thirty|forty|fifty)'
+  r'|\d+(?:\.\d+)?\s*(?:s|secs?|seconds?|m|mins?|minutes?|h|hrs?|hours?|d|days?|w|wks?|weeks?|mos?|months?|y|yrs?|years?)'
+  r'|today|tonight|tonite|tomorrow|tmrw?|tmw|yesterday|day after|day before'
+  r'|mon|tue|tues|wed|thu|thur|thurs|fri|sat|sun|(?:mon|tues|wednes|thurs|fri|satur|sun)days?|weekends?|weekdays?'
+  r'|next|this|last|coming|past|previous|following|week|month|year)\b'
+)
+
+def _first_value_timestamp(doc: dict) -> Optional[int]:
+  timestamps = []
+  for entity in doc.get('entities', {}).get(ENT_DATETIME_KEY, []):
+    for value in entity.get('values', [entity]):
+      if value.get('type') == 'interval':
+        value = value.get('from') or value.get('to') or {}
+      if 'value' not in value:
+        continue
+      try:
+        timestamps.append(int(datetime.datetime.fromisoformat(value['value']).timestamp()))
+      except ValueError:
+        continue
+  return min(timestamps) if timestamps else None
+
+def _persisted_key(message: str, local_datetime_with_tz: datetime.datetime):
+  # Wit only sees the reference time's UTC offset, not the timezone name
+  return (normalize_query(message), int(local_datetime_with_tz.utcoffset().total_seconds()))
+
+async def get_persisted_doc(message: str, local_datetime_with_tz: datetime.datetime) -> Optional[dict]:
+  try:
+    doc = await db_async.get_nlp_cache(*_persisted_key(message, local_datetime_with_tz), int(local_datetime_with_tz.timestamp()))
+  except Exception as e:
+    logging.warning('Failed to read NLP disk cache: %s', e)
+    return None
+  disk_cache_stats['hits' if doc else 'misses'] += 1
+  return json.loads(doc) if doc else None
 
-async def process_time_message(message, local_datetime_with_tz: datetime.datetime, valid_grains = None):
+async def persist_doc(message: str, local_datetime_with_tz: datetime.datetime, doc: dict):
+  if _RELATIVE_RE.search(normalize_query(message)):
+    return
+  expires_at = _first_value_timestamp(doc)
+  now = int(local_datetime_with_tz.timestamp())
+  if expires_at is None or expires_at <= now:
+    return
+  try:
+    await db_async.set_nlp_cache(*_persisted_key(message, local_datetime_with_tz), json.dumps(doc), expires_at, now)
+    disk_cache_stats['stores'] += 1
+  except Exception as e:
+    logging.warning('Failed to write NLP disk cache: %s', e)
+
+async def _prune_disk_cache():
+  while True:
+    try:
+      deleted = await db_async.prune_nlp_cache(env.NLP_DISK_CACHE_SIZE, int(time.time()))
+      if deleted:
+        logging.info('Pruned %d entries from the NLP disk cache', deleted)
+    except Exception as e:
+      logging.warning('Failed to prune NLP disk cache: %s', e)
+    await asyncio.sleep(env.NLP_DISK_CACHE_PRUNE_INTERVAL)
+
+async def process_time_message(message, local_datetime_with_tz: datetime.datetime, valid_grains = None) -> List[TimeResult]:
   if not wit:
     raise ValueError('NLP not initialized!')
   if not valid_grains:
@@ -57,10 +365,15 @@ async def process_time_message(message, local_datetime_with_tz: datetime.datetim
   elif type(valid_grains) is not set:
     valid_grains = set(valid_grains)
 
-  tz = local_datetime_with_tz.tzinfo
-
+  # Simple messages can be parsed locally, without a round trip to Wit
+  with tracing.span('nlp.local'):
+    doc = local_nlp.parse(message, local_datetime_with_tz) if env.LOCAL_NLP else None
   try:
-    doc = await wit.message(message, local_datetime_with_tz)
+    if doc is None:
+      doc = await fetch_doc(message, local_datetime_with_tz)
+  except WitUnavailableError as e:
+    logging.warning('Skipped Wit request: %s', e)
+    raise ProcessTimeMessageException('The API is having trouble right now! Please try again in a little while.')
   except Exception as e:
     logging.error('WIT API error')
     logging.exception(e)
@@ -73,110 +386,134 @@ async def process_time_message(message, local_datetime_with_tz: datetime.datetim
     raise ProcessTimeMessageException('The API has returned an error! Please try again later.')
 
   try:
-    if ENT_DATETIME_KEY not in doc['entities']:
-      return []
-
-    data_to_process = []
-    for ent in doc['entities'][ENT_DATETIME_KEY]:
-      body = ent['body']
-      if ent['type'] == 'interval':
-        is_interval = True
-        # Interval may be missing start or end; convert to single value
-        if 'from' not in ent:
-          grain = ent['to']['grain']
-          is_interval = False
-          values = [v['to'] for v in ent['values']]
-        elif 'to' not in ent:
-          grain = ent['from']['grain']
-          is_interval = False
-          values = [v['from'] for v in ent['values']]
-        else:
-          grain = ent['from']['grain']
-          values = ent['values']
-      else:
-        grain = ent['grain']
+    with tracing.span('nlp.convert'):
+      return convert_doc(doc, local_datetime_with_tz, valid_grains)
+  except ProcessTimeMessageException:
+    raise
+  except Exception as e:
+    raise ValueError(f'Error raised when processing doc "{doc}"') from e
+
+def convert_doc(doc: dict, local_datetime_with_tz: datetime.datetime, valid_grains: set) -> List[TimeResult]:
+  if ENT_DATETIME_KEY not in doc['entities']:
+    return []
+
+  data_to_process = []
+  for ent in doc['entities'][ENT_DATETIME_KEY]:
+    body = ent['body']
+    if ent['type'] == 'interval':
+      is_interval = True
+      # Interval may be missing start or end; convert to single value
+      if 'from' not in ent:
+        grain = ent['to']['grain']
+        is_interval = False
+        values = [v['to'] for v in ent['values']]
+      elif 'to' not in ent:
+        grain = ent['from']['grain']
         is_interval = False
+        values = [v['from'] for v in ent['values']]
+      else:
+        grain = ent['from']['grain']
         values = ent['values']
-      if grain in ENT_GRAIN_DATETIME:
-        data_to_process.append((body, grain, is_interval, values))
-
-    # Convert times
-    results_data = []
-    for (time_body, grain, is_interval, ent_values) in data_to_process:
-      #time_body = ent['body']
-      values = []
-      exclusive_timedelta = datetime.timedelta(days=1 if grain == 'day' else 0, hours=1 if grain == 'hour' else 0, minutes=1 if grain == 'minute' else 0, seconds=1 if grain == 'second' else 0)
-      #is_interval = ent['type'] == 'interval'
-
-      # If it's a date
-      if grain in ENT_GRAIN_DATE:
-        hour = local_datetime_with_tz.hour
-        minute = local_datetime_with_tz.minute
-        second = local_datetime_with_tz.second
-        # Format with date and time
-        timestamp_suffix = ':D'
-        for value in ent_values:
-          if is_interval:
-            datetime_from = datetime.datetime.fromisoformat(value['from']['value']).replace(hour=hour, minute=minute, second=second)
-            datetime_to = datetime.datetime.fromisoformat(value['to']['value']).replace(hour=hour, minute=minute, second=second)
-            values.append(f'<t:{utils.datetime_to_timestamp(datetime_from)}{timestamp_suffix}> to <t:{utils.datetime_to_timestamp(datetime_to - exclusive_timedelta)}{timestamp_suffix}>')
-          else:
-            date_value = datetime.datetime.fromisoformat(value['value']).replace(hour=hour, minute=minute, second=second)
-            values.append(f'<t:{utils.datetime_to_timestamp(date_value)}{timestamp_suffix}>')
-
-      # If it's a time but we only care about days
-      elif grain in ENT_GRAIN_TIME and 'day' in valid_grains and valid_grains.isdisjoint(ENT_GRAIN_TIME):
-        timestamp_suffix = ':D'
-        for value in ent_values:
-          if is_interval:
-            datetime_from = datetime.datetime.fromisoformat(value['from']['value'])
-            datetime_to = datetime.datetime.fromisoformat(value['to']['value']) - datetime.timedelta(seconds=1)
-            if datetime_from.date() == datetime_to.date():
-              values.append(f'<t:{utils.datetime_to_timestamp(datetime_from)}{timestamp_suffix}>')
-          else:
-            date_value = datetime.datetime.fromisoformat(value['value'])
-            values.append(f'<t:{utils.datetime_to_timestamp(date_value)}{timestamp_suffix}>')
-
-      # If it's a time
-      elif grain in ENT_GRAIN_TIME:
-        # Format with date and time by default
-        timestamp_suffix = ':f'
-        # Check which timestamp suffix should be used
-        time_duplicates = set()
-        values_to_save = []
-        for value in ent_values:
-          if is_interval:
-            datetime_from = datetime.datetime.fromisoformat(value['from']['value'])
-            datetime_to = datetime.datetime.fromisoformat(value['to']['value'])
-            time_interval = (datetime_from.time(), datetime_to.time())
-            # If there are multiple possibilities for hours, format as hour instead of date+hour (to remove unnecessary ambiguity)
-            if time_interval in time_duplicates:
-              timestamp_suffix = ':t'
-            else:
-              time_duplicates.add(time_interval)
-              values_to_save.append((datetime_from, datetime_to))
+    else:
+      grain = ent['grain']
+      is_interval = False
+      values = ent['values']
+    if grain in ENT_GRAIN_DATETIME or grain in valid_grains:
+      data_to_process.append((body, grain, is_interval, values))
+
+  # Convert times
+  results_data = []
+  fromisoformat = datetime.datetime.fromisoformat
+  only_days = 'day' in valid_grains and valid_grains.isdisjoint(ENT_GRAIN_TIME)
+  allow_ranges = not valid_grains.isdisjoint(ENT_GRAIN_RANGE)
+  # Dates are displayed with the reference time of day
+  seconds_of_day = local_datetime_with_tz.hour * 3600 + local_datetime_with_tz.minute * 60 + local_datetime_with_tz.second
+  def day_timestamp(dt: datetime.datetime) -> int:
+    return int(dt.timestamp()) - (dt.hour * 3600 + dt.minute * 60 + dt.second) + seconds_of_day
+  for (time_body, grain, is_interval, ent_values) in data_to_process:
+    values = []
+
+    # If it's a date
+    if grain in ENT_GRAIN_DATE:
+      # Format with date and time
+      timestamp_suffix = ':D'
+      exclusive_seconds = int(ENT_GRAIN_TIMEDELTA[grain].total_seconds())
+      for value in ent_values:
+        if is_interval:
+          datetime_from = fromisoformat(value['from']['value'])
+          datetime_to = fromisoformat(value['to']['value'])
+          timestamp_from = day_timestamp(datetime_from)
+          timestamp_to = day_timestamp(datetime_to) - exclusive_seconds
+          values.append(TimeValue(timestamp_from, timestamp_to, timestamp_suffix))
+        else:
+          date_value = fromisoformat(value['value'])
+          timestamp = day_timestamp(date_value)
+          values.append(TimeValue(timestamp, None, timestamp_suffix))
+
+    # If it's a week or month, as a range of days
+    elif grain in ENT_GRAIN_RANGE:
+      timestamp_suffix = ':D'
+      for value in ent_values:
+        if is_interval:
+          datetime_from = fromisoformat(value['from']['value'])
+          datetime_to = fromisoformat(value['to']['value']) - ONE_SECOND
+        else:
+          datetime_from = fromisoformat(value['value'])
+          datetime_to = datetime_from + ENT_GRAIN_TIMEDELTA[grain] - ONE_SECOND
+        values.append(TimeValue(day_timestamp(datetime_from), day_timestamp(datetime_to), timestamp_suffix))
+
+    # If it's a time but we only care about days
+    elif grain in ENT_GRAIN_TIME and only_days:
+      timestamp_suffix = ':D'
+      for value in ent_values:
+        if is_interval:
+          datetime_from = fromisoformat(value['from']['value'])
+          datetime_to = fromisoformat(value['to']['value']) - ONE_SECOND
+          if datetime_from.date() == datetime_to.date():
+            values.append(TimeValue(int(datetime_from.timestamp()), None, timestamp_suffix))
+          # Intervals over several days (e.g. "this weekend") become ranges of days, when those are accepted
+          elif allow_ranges:
+            values.append(TimeValue(day_timestamp(datetime_from), day_timestamp(datetime_to), timestamp_suffix))
+        else:
+          values.append(TimeValue(int(fromisoformat(value['value']).timestamp()), None, timestamp_suffix))
+
+    # If it's a time
+    elif grain in ENT_GRAIN_TIME:
+      # Format with date and time by default
+      timestamp_suffix = ':f'
+      exclusive_timedelta = ENT_GRAIN_TIMEDELTA[grain]
+      # Check which timestamp suffix should be used
+      time_duplicates = set()
+      values_to_save = []
+      for value in ent_values:
+        if is_interval:
+          datetime_from = fromisoformat(value['from']['value'])
+          datetime_to = fromisoformat(value['to']['value'])
+          time_interval = (datetime_from.time(), datetime_to.time())
+          # If there are multiple possibilities for hours, format as hour instead of date+hour (to remove unnecessary ambiguity)
+          if time_interval in time_duplicates:
+            timestamp_suffix = ':t'
           else:
-            datetime_value = datetime.datetime.fromisoformat(value['value'])
-            time_value = datetime_value.time()
-            # If there are multiple possibilities for hours, format as hour instead of date+hour (to remove unnecessary ambiguity)
-            if time_value in time_duplicates:
-              timestamp_suffix = ':t'
-            else:
-              time_duplicates.add(time_value)
-              values_to_save.append(datetime_value)
-        for value in values_to_save:
-          if is_interval:
-            values.append(f'<t:{utils.datetime_to_timestamp(value[0])}{timestamp_suffix}> to <t:{utils.datetime_to_timestamp(value[1] - exclusive_timedelta)}{timestamp_suffix}>')
+            time_duplicates.add(time_interval)
+            values_to_save.append((int(datetime_from.timestamp()), int((datetime_to - exclusive_timedelta).timestamp())))
+        else:
+          datetime_value = fromisoformat(value['value'])
+          time_value = datetime_value.time()
+          # If there are multiple possibilities for hours, format as hour instead of date+hour (to remove unnecessary ambiguity)
+          if time_value in time_duplicates:
+            timestamp_suffix = ':t'
           else:
-            values.append(f'<t:{utils.datetime_to_timestamp(value)}{timestamp_suffix}>')
+            time_duplicates.add(time_value)
+            values_to_save.append(int(datetime_value.timestamp()))
+      for value in values_to_save:
+        if is_interval:
+          values.append(TimeValue(value[0], value[1], timestamp_suffix))
+        else:
+          values.append(TimeValue(value, None, timestamp_suffix))
 
-      if len(values) == 0:
-        logging.error('Couldn\'t find any values for body "%s"!', time_body)
-        continue
-      results_data.append((time_body, values))
+    if len(values) == 0:
+      logging.error('Couldn\'t find any values for body "%s"!', time_body)
+      continue
+    results_data.append(TimeResult(time_body, grain, values))
 
-    return results_data
-  except ProcessTimeMessageException:
-    raise
-  except Exception as e:
-    raise ValueError(f'Error raised when processing doc "{doc}"') from e
+  return results_data
@@ -0,0 +1,117 @@
+import datetime
+import logging as pyLogging
+import os
+import re
+import tempfile
+import unittest
+
+import dateutil.tz
+
+import db
+import discord_bot
+import nlp
+from bench.nlp_corpus import CORPUS_PATH, load_corpus
+
+ANCHORAGE = dateutil.tz.gettz('America/Anchorage')
+TZ = dateutil.tz.gettz('America/Los_Angeles')
+REFERENCE_TIME = datetime.datetime(2024, 5, 1, 16, 20, 11, tzinfo=TZ)
+
+
+def dates(value: nlp.TimeValue, tz=TZ):
+  return (datetime.datetime.fromtimestamp(value.start, tz).date(), datetime.datetime.fromtimestamp(value.end, tz).date())
+
+def wit_doc(body: str, entity: dict) -> dict:
+  return {'text': body, 'entities': {nlp.ENT_DATETIME_KEY: [{'body': body, **entity}]}}
+
+
+class ConvertDateRangeTest(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    # Ranges that aren't requested have no usable values, which nlp logs as errors
+    pyLogging.getLogger('soupbot.nlp').setLevel(pyLogging.CRITICAL)
+
+  @classmethod
+  def tearDownClass(cls):
+    pyLogging.getLogger('soupbot.nlp').setLevel(pyLogging.NOTSET)
+
+  def test_recorded_ranges(self):
+    corpus = {text: (doc, reference_time) for (text, doc, reference_time, _) in load_corpus(CORPUS_PATH)}
+    cases = {
+      'next week': (datetime.date(2024, 5, 6), datetime.date(2024, 5, 12)),
+      'this weekend': (datetime.date(2024, 5, 3), datetime.date(2024, 5, 5)),
+      'may 3rd to may 5th': (datetime.date(2024, 5, 3), datetime.date(2024, 5, 5)),
+    }
+    for (text, expected) in cases.items():
+      with self.subTest(text=text):
+        (doc, reference_time) = corpus[text]
+        (result,) = nlp.convert_doc(doc, reference_time, nlp.ENT_GRAIN_DATE_RANGE)
+        self.assertEqual(dates(result.values[0]), expected)
+
+  def test_ranges_only_when_requested(self):
+    corpus = {text: (doc, reference_time) for (text, doc, reference_time, _) in load_corpus(CORPUS_PATH)}
+    for text in ['next week', 'this weekend']:
+      with self.subTest(text=text):
+        (doc, reference_time) = corpus[text]
+        self.assertEqual(nlp.convert_doc(doc, reference_time, nlp.ENT_GRAIN_DATE), [])
+
+  def test_ranges_across_dst(self):
+    # DST ends on 2024-11-03 in Los Angeles
+    week = wit_doc('next week', {'type': 'value', 'grain': 'week', 'value': '2024-10-28T00:00:00.000-07:00', 'values': [
+      {'type': 'value', 'grain': 'week', 'value': '2024-10-28T00:00:00.000-07:00'},
+    ]})
+    (result,) = nlp.convert_doc(week, REFERENCE_TIME, nlp.ENT_GRAIN_DATE_RANGE)
+    self.assertEqual(dates(result.values[0]), (datetime.date(2024, 10, 28), datetime.date(2024, 11, 3)))
+    month = wit_doc('november', {'type': 'value', 'grain': 'month', 'value': '2024-11-01T00:00:00.000-07:00', 'values': [
+      {'type': 'value', 'grain': 'month', 'value': '2024-11-01T00:00:00.000-07:00'},
+    ]})
+    (result,) = nlp.convert_doc(month, REFERENCE_TIME, nlp.ENT_GRAIN_DATE_RANGE)
+    self.assertEqual(dates(result.values[0]), (datetime.date(2024, 11, 1), datetime.date(2024, 11, 30)))
+
+
+class AvailabilityGridTest(unittest.TestCase):
+  def test_labels_across_dst(self):
+    # DST ends on 2024-11-03 in Anchorage, in the middle of the range
+    start_date = datetime.date(2024, 10, 30)
+    end_date = datetime.date(2024, 11, 8)
+    availabilities = [
+      (datetime.date(2024, 11, 2), 1, 1, ''),
+      (datetime.date(2024, 11, 4), 2, 0, ''),
+      (datetime.date(2024, 11, 4), 3, 1, ''),
+    ]
+    lines = discord_bot.get_availability_range_lines(availabilities, start_date, end_date)
+    self.assertEqual(len(lines), 10)
+    for (i, line) in enumerate(lines):
+      on_date = start_date + datetime.timedelta(days=i)
+      with self.subTest(on_date=on_date):
+        label = datetime.datetime.fromtimestamp(int(re.match(r'<t:(\d+):D>', line).group(1)), ANCHORAGE)
+        self.assertEqual((label.date(), label.time()), (on_date, datetime.time()))
+    self.assertEqual(lines[3].split(':D>')[1], ': ✅ <@1>')
+    self.assertEqual(lines[5].split(':D>')[1], ': ✅ <@3> ❌ <@2>')
+    self.assertEqual(lines[9].split(':D>')[1], ': -')
+
+
+class AvailabilityRangeQueryTest(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    db.init(os.path.join(self.tmp.name, 'test.db'))
+
+  def tearDown(self):
+    db.close()
+    self.tmp.cleanup()
+
+  def test_inclusive_range_for_one_server(self):
+    for day in range(1, 11):
+      db.set_availability_for_user(1, 10 + day % 2, datetime.date(2024, 5, day), day % 3 != 0, f'day {day}')
+    db.set_availability_for_user(2, 10, datetime.date(2024, 5, 5), True, 'other server')
+    rows = db.get_availabilities_for_range(1, datetime.date(2024, 5, 3), datetime.date(2024, 5, 6))
+    self.assertEqual(rows, [
+      (datetime.date(2024, 5, 3), 11, 0, 'day 3'),
+      (datetime.date(2024, 5, 4), 10, 1, 'day 4'),
+      (datetime.date(2024, 5, 5), 11, 1, 'day 5'),
+      (datetime.date(2024, 5, 6), 10, 0, 'day 6'),
+    ])
+    self.assertEqual(db.get_availabilities_for_range(1, datetime.date(2024, 6, 1), datetime.date(2024, 6, 30)), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
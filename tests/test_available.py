@@ -0,0 +1,79 @@
+import contextlib
+import datetime
+import io
+import os
+import tempfile
+import unittest
+
+import discord
+
+import db_async
+import discord_bot
+import env
+import metrics
+import nlp
+from bench.fake_wit import FakeWitServer
+from bench.fakes import FakeGuild, FakeMessage, FakeUser
+
+NOW = datetime.datetime(2024, 5, 6, 10, tzinfo=datetime.timezone.utc)
+
+
+# handle_availability only looks at replies to actual discord.Message objects, whose created_at is otherwise read-only
+class ReferencedMessage(FakeMessage, discord.Message):
+  created_at = None
+
+
+class AvailableErrorsTest(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.fake_wit = FakeWitServer()
+    await self.fake_wit.start()
+    env.WIT_TOKEN = 'test'
+    env.WIT_URL = self.fake_wit.url
+    env.WIT_MAX_RETRIES = 0
+    env.DB_PATH = os.path.join(self.tmp.name, 'test.db')
+    db_async.init()
+    nlp.init()
+    await nlp.start()
+    self.bot_user = FakeUser('SoupBot', bot=True)
+    self.user = FakeUser('user')
+    self.guild = FakeGuild([self.user], self.bot_user)
+    self.client = discord_bot.create_client()
+    self.client._connection.user = self.bot_user
+    metrics.commands.clear()
+
+  async def asyncTearDown(self):
+    await nlp.close()
+    await db_async.close()
+    await self.fake_wit.close()
+    env.WIT_MAX_RETRIES = 2
+    metrics.commands.clear()
+    self.tmp.cleanup()
+
+  async def available(self, content: str, reply_to: str = None) -> FakeMessage:
+    message = FakeMessage(content, self.user, self.guild, NOW)
+    if reply_to is not None:
+      message.reference = discord.MessageReference(message_id=0, channel_id=self.guild.channel.id)
+      message.reference.resolved = ReferencedMessage(reply_to, self.user, self.guild, NOW)
+    # Failed parses are logged with their tracebacks
+    with self.assertLogs('soupbot', 'ERROR'), contextlib.redirect_stderr(io.StringIO()):
+      await self.client.on_message(message)
+    return message
+
+  async def test_failed_candidate_is_not_an_error_when_another_matches(self):
+    self.fake_wit.fail_next(1, status=400)
+    message = await self.available('$available tomorrow', reply_to='see you around the solstice')
+    self.assertEqual(self.fake_wit.errors, 1)
+    self.assertTrue(message.replies[0][0].startswith('Marked you as available'))
+    self.assertEqual(metrics.commands['$available'].errors, 0)
+
+  async def test_error_when_no_candidate_matches(self):
+    self.fake_wit.fail_next(2, status=400)
+    message = await self.available('$available around the solstice', reply_to='see you around the solstice')
+    self.assertEqual(self.fake_wit.errors, 2)
+    self.assertTrue(message.replies[0][0].startswith('Unable to find a date'))
+    self.assertEqual(metrics.commands['$available'].errors, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,110 @@
+import datetime
+import io
+import logging as pyLogging
+import os
+import tempfile
+import unittest
+
+import bulk
+import db
+
+TIMESTAMP = datetime.datetime(2024, 5, 6, 10, tzinfo=datetime.timezone.utc)
+SERVER_ID = 10
+OTHER_SERVER_ID = 20
+
+
+def fill_db():
+  db.set_timezone_for_user_id(1, 'Europe/Lisbon', TIMESTAMP)
+  db.set_timezone_for_user_id(2, None, TIMESTAMP)
+  db.set_timezone_for_user_id(3, 'Asia/Tokyo, "quoted"', TIMESTAMP)
+  for (server_id, user_id, from_user_id) in [(SERVER_ID, 1, 2), (SERVER_ID, 1, 3), (SERVER_ID, 2, None), (OTHER_SERVER_ID, 3, 1)]:
+    db.save_dinkdonk_for_user(user_id, server_id, from_user_id, TIMESTAMP)
+  db.toggle_dinkdonk_alerts(2, SERVER_ID, TIMESTAMP)
+  for day in range(1, 6):
+    db.set_availability_for_user(SERVER_ID, day % 2 + 1, datetime.date(2024, 5, day), day % 3 != 0, f'day {day}, with ünïcode\nand a line break', TIMESTAMP)
+  db.set_availability_for_user(OTHER_SERVER_ID, 1, datetime.date(2024, 5, 1), True, '', TIMESTAMP)
+  # Not something the bot writes, but older databases may have them
+  with db.conn:
+    db.conn.execute('INSERT INTO availability (server_id, user_id, on_date, is_available, description, last_modified) VALUES (?, ?, ?, ?, NULL, ?)', (OTHER_SERVER_ID, 2, '2024-05-02', 0, 0))
+
+def dump_table(table: str):
+  columns = ', '.join(bulk.TABLES[table]['columns'])
+  return sorted(db.conn.execute(f'SELECT {columns} FROM {table}').fetchall(), key=repr)
+
+
+class BulkRoundTripTest(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    pyLogging.getLogger('soupbot.bulk').setLevel(pyLogging.WARNING)
+
+  @classmethod
+  def tearDownClass(cls):
+    pyLogging.getLogger('soupbot.bulk').setLevel(pyLogging.NOTSET)
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    db.init(os.path.join(self.tmp.name, 'source.db'))
+    fill_db()
+    self.tables = {table: dump_table(table) for table in bulk.TABLES}
+
+  def tearDown(self):
+    db.close()
+    self.tmp.cleanup()
+
+  def export_all(self, fmt: str, server_id=None):
+    files = {}
+    for table in bulk.TABLES:
+      if server_id is not None and 'server_id' not in bulk.TABLES[table]['columns']:
+        continue
+      files[table] = io.StringIO(newline='')
+      bulk.export_table(table, files[table], fmt, chunk_size=2, server_id=server_id)
+    return files
+
+  def import_all(self, files, fmt: str, name: str):
+    db.close()
+    db.init(os.path.join(self.tmp.name, name))
+    for (table, file) in files.items():
+      file.seek(0)
+      bulk.import_table(table, file, fmt, chunk_size=2)
+    return {table: dump_table(table) for table in bulk.TABLES}
+
+  def test_jsonl_round_trip(self):
+    self.assertEqual(self.import_all(self.export_all('jsonl'), 'jsonl', 'jsonl.db'), self.tables)
+
+  def test_csv_round_trip(self):
+    imported = self.import_all(self.export_all('csv'), 'csv', 'csv.db')
+    # CSV can't tell empty text apart from NULLs, so those come back empty
+    expected = {
+      table: sorted((tuple('' if value is None and bulk.TABLES[table]['columns'][column] is str else value for (column, value) in zip(bulk.TABLES[table]['columns'], row)) for row in rows), key=repr)
+      for (table, rows) in self.tables.items()
+    }
+    self.assertIn((2, '', int(TIMESTAMP.timestamp())), expected['users'])
+    self.assertIn((OTHER_SERVER_ID, 2, '2024-05-02', 0, '', 0), expected['availability'])
+    self.assertEqual(imported, expected)
+
+  def test_export_one_server(self):
+    for fmt in bulk.FORMATS:
+      with self.subTest(fmt=fmt):
+        files = self.export_all(fmt, server_id=SERVER_ID)
+        self.assertNotIn('users', files)
+        imported = self.import_all(files, fmt, f'server-{fmt}.db')
+        self.assertEqual(imported['users'], [])
+        for table in ('dinkdonk', 'cross_dinkdonks', 'availability'):
+          self.assertTrue(imported[table])
+          self.assertEqual(imported[table], [row for row in self.tables[table] if row[0] == SERVER_ID])
+        db.close()
+        db.init(os.path.join(self.tmp.name, 'source.db'))
+
+  def test_skip_existing(self):
+    jsonl = self.export_all('jsonl')
+    db.set_timezone_for_user_id(1, 'America/Chicago', TIMESTAMP)
+    jsonl['users'].seek(0)
+    self.assertEqual(bulk.import_table('users', jsonl['users'], 'jsonl', chunk_size=2, replace=False), 3)
+    self.assertEqual(db.get_timezone_for_user_id(1), 'America/Chicago')
+    jsonl['users'].seek(0)
+    bulk.import_table('users', jsonl['users'], 'jsonl', chunk_size=2)
+    self.assertEqual(db.get_timezone_for_user_id(1), 'Europe/Lisbon')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,99 @@
+import asyncio
+import datetime
+import os
+import tempfile
+import unittest
+
+import db
+import db_async
+import env
+
+ON_DATE = datetime.date(2024, 5, 6)
+
+
+def set_timezone_then_fail(user_id: int, tz: str):
+  db.set_timezone_for_user_id(user_id, tz)
+  raise RuntimeError('failed after writing')
+
+
+class RunBatchTest(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    db.init(os.path.join(self.tmp.name, 'test.db'))
+
+  def tearDown(self):
+    db.close()
+    self.tmp.cleanup()
+
+  def test_failing_call_only_rolls_back_its_own_writes(self):
+    results = db.run_batch([
+      (db.set_timezone_for_user_id, (1, 'Europe/Lisbon'), {}),
+      (set_timezone_then_fail, (2, 'Asia/Tokyo'), {}),
+      (db.set_availability_for_user, (10, 1, ON_DATE, True, 'sure'), {}),
+    ])
+    self.assertEqual([success for (success, _) in results], [True, False, True])
+    self.assertIsInstance(results[1][1], RuntimeError)
+    self.assertEqual(db.get_timezone_for_user_id(1), 'Europe/Lisbon')
+    self.assertIsNone(db.get_timezone_for_user_id(2))
+    self.assertEqual(db.get_availabilities_for_date(10, ON_DATE), [(1, 1, 'sure')])
+
+
+class WriteBehindTest(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    env.DB_PATH = os.path.join(self.tmp.name, 'test.db')
+    env.DB_WRITE_BEHIND = True
+    # Long enough that only reads, full batches or shutdown flush the queue
+    env.DB_FLUSH_INTERVAL_MS = 60000
+    env.TZ_CACHE_SIZE = 0
+    db_async.init()
+
+  async def asyncTearDown(self):
+    await db_async.close()
+    env.DB_WRITE_BEHIND = False
+    env.DB_FLUSH_INTERVAL_MS = 50
+    env.DB_FLUSH_MAX_OPS = 100
+    env.TZ_CACHE_SIZE = 4096
+    self.tmp.cleanup()
+
+  async def test_each_caller_gets_its_own_result(self):
+    env.DB_FLUSH_MAX_OPS = 3
+    results = await asyncio.gather(
+      db_async.set_availability_for_user(10, 1, ON_DATE, True, 'sure'),
+      # Fails inside the batch, since the date can't be formatted
+      db_async.set_availability_for_user(10, 2, 'not a date', True, 'oops'),
+      db_async.set_availability_for_user(10, 3, ON_DATE, False, 'nope'),
+      return_exceptions=True,
+    )
+    self.assertIsNone(results[0])
+    self.assertIsInstance(results[1], AttributeError)
+    self.assertIsNone(results[2])
+    self.assertEqual(sorted(await db_async.get_availabilities_for_date(10, ON_DATE)), [(1, 1, 'sure'), (3, 0, 'nope')])
+
+  async def test_reads_flush_queued_writes_first(self):
+    write = asyncio.ensure_future(db_async.set_availability_for_user(10, 1, ON_DATE, True, 'sure'))
+    await asyncio.sleep(0)
+    self.assertEqual(len(db_async._pending), 1)
+    self.assertEqual(await db_async.get_availabilities_for_date(10, ON_DATE), [(1, 1, 'sure')])
+    self.assertEqual(db_async._pending, [])
+    await write
+
+  async def test_close_flushes_queued_writes(self):
+    writes = [
+      asyncio.ensure_future(db_async.set_timezone_for_user_id(1, 'Europe/Lisbon')),
+      asyncio.ensure_future(db_async.set_availability_for_user(10, 1, ON_DATE, True, 'sure')),
+    ]
+    await asyncio.sleep(0)
+    self.assertEqual(len(db_async._pending), 2)
+    await db_async.close()
+    await asyncio.gather(*writes)
+    db.init(env.DB_PATH)
+    try:
+      self.assertEqual(db.get_timezone_for_user_id(1), 'Europe/Lisbon')
+      self.assertEqual(db.get_availabilities_for_date(10, ON_DATE), [(1, 1, 'sure')])
+    finally:
+      db.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
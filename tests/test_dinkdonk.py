@@ -0,0 +1,74 @@
+import asyncio
+import datetime
+import os
+import tempfile
+import unittest
+
+import db_async
+import discord_bot
+import env
+from bench.fakes import FakeGuild, FakeMessage, FakeUser
+
+NOW = datetime.datetime(2024, 5, 6, 10, tzinfo=datetime.timezone.utc)
+
+
+class SlowChunkGuild(FakeGuild):
+  async def chunk(self, cache: bool = True):
+    await asyncio.sleep(0.05)
+    return self.members
+
+
+class DinkdonkCooldownTest(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    env.DB_PATH = os.path.join(self.tmp.name, 'test.db')
+    db_async.init()
+    self.bot_user = FakeUser('SoupBot', bot=True)
+    self.users = [FakeUser(f'user{i}') for i in range(5)]
+
+  async def asyncTearDown(self):
+    await db_async.close()
+    env.MEMBER_CACHE = 'all'
+    self.tmp.cleanup()
+
+  async def toll_concurrently(self, member_cache: str, count: int) -> int:
+    env.MEMBER_CACHE = member_cache
+    client = discord_bot.create_client()
+    client._connection.user = self.bot_user
+    guild = SlowChunkGuild(self.users, self.bot_user)
+    client.get_channel = lambda id: guild.channel if id == guild.channel.id else None
+    messages = [FakeMessage('$dinkdonk', self.users[i], guild, NOW) for i in range(count)]
+    await asyncio.gather(*(client.on_message(message) for message in messages))
+    return sum(1 for message in messages for (_, kwargs) in message.replies if 'embed' in kwargs)
+
+  async def test_concurrent_dinkdonks_toll_once(self):
+    for member_cache in ['all', 'none']:
+      with self.subTest(member_cache=member_cache):
+        self.assertEqual(await self.toll_concurrently(member_cache, 3), 1)
+        db_async._dd_cache.clear()
+
+  async def dinkdonk(self, guild: FakeGuild, user: FakeUser, created_at: datetime.datetime) -> FakeMessage:
+    client = discord_bot.create_client()
+    client._connection.user = self.bot_user
+    client.get_channel = lambda id: guild.channel if id == guild.channel.id else None
+    message = FakeMessage('$dinkdonk', user, guild, created_at)
+    await client.on_message(message)
+    return message
+
+  async def test_cooldown_survives_restart(self):
+    for write_behind in [False, True]:
+      with self.subTest(write_behind=write_behind):
+        env.DB_WRITE_BEHIND = write_behind
+        guild = FakeGuild(self.users, self.bot_user)
+        message = await self.dinkdonk(guild, self.users[0], NOW)
+        self.assertIn('embed', message.replies[0][1])
+        # The cooldown is read from the database on startup
+        await db_async.close()
+        db_async.init()
+        message = await self.dinkdonk(guild, self.users[1], NOW + datetime.timedelta(minutes=1))
+        self.assertIn('on cooldown', message.replies[0][0])
+    env.DB_WRITE_BEHIND = False
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,124 @@
+import os
+import random
+import tempfile
+import unittest
+
+import db
+import utils
+from leaderboard import ServerLeaderboard
+
+SERVER_ID = 10
+
+
+def old_check_if_has_reset_privilege(rows, user_id, threshold=None) -> bool:
+  # The scan that db.check_if_has_reset_privilege used to run over the rows with enough dinkdonks
+  values = [(curr_user_id, curr_count) for (curr_user_id, curr_count) in rows if curr_count >= db.DINKDONK_RESET_PRIVILEGE_MINIMUM]
+  if len(values) == 0:
+    return False
+  max_user_id, max_count = values[0]
+  for curr_user_id, curr_count in values[1:]:
+    if curr_count >= max_count:
+      max_user_id, max_count = curr_user_id, curr_count
+  return (threshold is not None and max_count >= threshold) or max_user_id == user_id
+
+def rows_of(counts: dict):
+  # Like db.get_dinkdonks_for_server, which scans the primary key in user ID order
+  return sorted((user_id, count) for (user_id, count) in counts.items() if count > 0)
+
+
+class ServerLeaderboardTest(unittest.TestCase):
+  def test_matches_rank_dinkdonks(self):
+    rng = random.Random(1234)
+    for _ in range(50):
+      # Few distinct counts, so that there are plenty of ties
+      counts = {user_id: rng.randint(0, 8) for user_id in rng.sample(range(1, 100), rng.randint(0, 30))}
+      leaderboard = ServerLeaderboard(rows_of(counts))
+      for _ in range(40):
+        user_id = rng.randint(1, 100)
+        counts[user_id] = max(0, counts.get(user_id, 0) + rng.choice([-3, -1, 1, 1, 2]))
+        leaderboard.set_count(user_id, counts[user_id])
+        rows = rows_of(counts)
+        self.assertEqual(len(leaderboard), len(rows))
+        self.assertEqual(leaderboard.rank(), utils.rank_dinkdonks(rows))
+        cut_off_at_length = rng.randint(1, 5)
+        self.assertEqual(leaderboard.rank(cut_off_at_length), utils.rank_dinkdonks(rows, cut_off_at_length=cut_off_at_length))
+        for (user_id, _) in rows:
+          self.assertEqual(leaderboard.place_of(user_id), len(utils.rank_dinkdonks(rows, cut_off_at_user_id=user_id)))
+        self.assertIsNone(leaderboard.place_of(101))
+
+  def test_champion_recomputed_when_its_count_drops(self):
+    leaderboard = ServerLeaderboard([(1, 5), (2, 7), (3, 7), (4, 6)])
+    # Ties go to the last user ID
+    self.assertEqual(leaderboard.champion, (3, 7))
+    leaderboard.set_count(3, 6)
+    self.assertEqual(leaderboard.champion, (2, 7))
+    leaderboard.set_count(2, 1)
+    self.assertEqual(leaderboard.champion, (4, 6))
+    # Someone else dropping doesn't change it
+    leaderboard.set_count(1, 0)
+    self.assertEqual(leaderboard.champion, (4, 6))
+    for user_id in (2, 3, 4):
+      leaderboard.set_count(user_id, 0)
+    self.assertIsNone(leaderboard.champion)
+
+
+class ServerLeaderboardDBTest(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    db.init(os.path.join(self.tmp.name, 'test.db'))
+
+  def tearDown(self):
+    db.close()
+    self.tmp.cleanup()
+
+  def test_clear_server_dinkdonks(self):
+    for (user_id, count) in [(1, 3), (2, 1), (3, 3)]:
+      for _ in range(count):
+        db.save_dinkdonk_for_user(user_id, SERVER_ID)
+    db.save_dinkdonk_for_user(1, SERVER_ID + 1)
+    self.assertEqual(db.get_ranked_dinkdonks_for_server(SERVER_ID), [(3, [1, 3]), (1, [2])])
+    self.assertEqual(db.get_dinkdonk_place_for_user(2, SERVER_ID), 2)
+    db.clear_server_dinkdonks(SERVER_ID)
+    self.assertEqual(db.get_ranked_dinkdonks_for_server(SERVER_ID), [])
+    self.assertIsNone(db.get_dinkdonk_place_for_user(1, SERVER_ID))
+    # Other servers are left alone
+    self.assertEqual(db.get_ranked_dinkdonks_for_server(SERVER_ID + 1), [(1, [1])])
+    # Counting starts over, and the index still agrees with the table
+    db.save_dinkdonk_for_user(2, SERVER_ID)
+    self.assertEqual(db.get_ranked_dinkdonks_for_server(SERVER_ID), [(1, [2])])
+    self.assertEqual(db.get_ranked_dinkdonks_for_server(SERVER_ID), utils.rank_dinkdonks(db.get_dinkdonks_for_server(SERVER_ID)))
+
+  def test_champion_matches_reset_privilege_scan(self):
+    rng = random.Random(5678)
+    minimum = db.DINKDONK_RESET_PRIVILEGE_MINIMUM
+    for _ in range(50):
+      counts = {user_id: rng.randint(minimum - 3, minimum + 3) for user_id in rng.sample(range(1, 30), rng.randint(0, 10))}
+      leaderboard = ServerLeaderboard(rows_of(counts))
+      # Stands in for the index that db would build from the table
+      db._leaderboards[SERVER_ID] = leaderboard
+      for _ in range(40):
+        user_id = rng.randint(1, 30)
+        counts[user_id] = max(0, counts.get(user_id, minimum) + rng.choice([-3, -1, 1, 2]))
+        leaderboard.set_count(user_id, counts[user_id])
+        rows = rows_of(counts)
+        for threshold in (None, minimum + 2):
+          with self.subTest(threshold=threshold):
+            self.assertEqual(
+              [db.check_if_has_reset_privilege(user_id, SERVER_ID, threshold) for user_id in range(1, 31)],
+              [old_check_if_has_reset_privilege(rows, user_id, threshold) for user_id in range(1, 31)],
+            )
+
+  def test_reset_privilege(self):
+    minimum = db.DINKDONK_RESET_PRIVILEGE_MINIMUM
+    for (user_id, count) in [(1, minimum - 1), (2, minimum + 1), (3, minimum + 1)]:
+      for _ in range(count):
+        db.save_dinkdonk_for_user(user_id, SERVER_ID)
+    self.assertEqual([db.check_if_has_reset_privilege(user_id, SERVER_ID) for user_id in (1, 2, 3)], [False, False, True])
+    self.assertTrue(db.check_if_has_reset_privilege(1, SERVER_ID, threshold=minimum + 1))
+    self.assertFalse(db.check_if_has_reset_privilege(1, SERVER_ID, threshold=minimum + 2))
+    db.clear_server_dinkdonks(SERVER_ID)
+    self.assertFalse(db.check_if_has_reset_privilege(3, SERVER_ID))
+
+
+if __name__ == '__main__':
+  unittest.main()
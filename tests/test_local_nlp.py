@@ -0,0 +1,116 @@
+import datetime
+import logging as pyLogging
+import unittest
+
+import dateutil.tz
+
+import local_nlp
+import metrics
+import nlp
+from bench.nlp_corpus import CORPUS_PATH, load_corpus
+
+TZ = dateutil.tz.gettz('America/Los_Angeles')
+# A Wednesday, like the reference time of the recorded corpus
+REFERENCE_TIME = datetime.datetime(2024, 5, 1, 16, 20, 11, tzinfo=TZ)
+# Recorded phrases that the local parser should answer exactly like Wit; everything else must go to Wit
+LOCAL_PHRASES = {'at 9pm', 'tomorrow at 3:30pm', 'friday 3-5pm', 'tomorrow', 'friday'}
+
+
+def summarize(results):
+  return [(result.body, result.grain, [(value.start, value.end, value.style) for value in result.values]) for result in results]
+
+def timestamp(*args) -> int:
+  return int(datetime.datetime(*args, tzinfo=TZ).timestamp())
+
+
+class CorpusTest(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    # Some recorded responses have no usable values on purpose, which nlp logs as errors
+    pyLogging.getLogger('soupbot.nlp').setLevel(pyLogging.CRITICAL)
+
+  @classmethod
+  def tearDownClass(cls):
+    pyLogging.getLogger('soupbot.nlp').setLevel(pyLogging.NOTSET)
+
+  def test_matches_recorded_wit_responses(self):
+    corpus = load_corpus(CORPUS_PATH)
+    self.assertTrue(LOCAL_PHRASES <= {text for (text, _, _, _) in corpus})
+    for (text, wit_doc, reference_time, valid_grains) in corpus:
+      with self.subTest(text=text):
+        local_doc = local_nlp._parse(text, reference_time)
+        if text not in LOCAL_PHRASES:
+          self.assertIsNone(local_doc)
+          continue
+        self.assertIsNotNone(local_doc)
+        self.assertEqual(
+          summarize(nlp.convert_doc(local_doc, reference_time, valid_grains)),
+          summarize(nlp.convert_doc(wit_doc, reference_time, valid_grains)),
+        )
+
+
+class TimeRangeTest(unittest.TestCase):
+  def parse_interval(self, message: str):
+    doc = local_nlp._parse(message, REFERENCE_TIME)
+    self.assertIsNotNone(doc)
+    value = doc['entities'][local_nlp.ENT_DATETIME_KEY][0]['values'][0]
+    self.assertEqual(value['type'], 'interval')
+    return (datetime.datetime.fromisoformat(value['from']['value']), datetime.datetime.fromisoformat(value['to']['value']))
+
+  def test_interval_end_is_exclusive(self):
+    # Like Wit, the end of an interval is one grain past the last hour or minute
+    self.assertEqual(self.parse_interval('tomorrow 3-5pm'), (datetime.datetime(2024, 5, 2, 15, tzinfo=TZ), datetime.datetime(2024, 5, 2, 18, tzinfo=TZ)))
+    self.assertEqual(self.parse_interval('tomorrow 3:30-5pm'), (datetime.datetime(2024, 5, 2, 15, 30, tzinfo=TZ), datetime.datetime(2024, 5, 2, 17, 1, tzinfo=TZ)))
+    (result,) = nlp.convert_doc(local_nlp._parse('tomorrow 3-5pm', REFERENCE_TIME), REFERENCE_TIME, nlp.ENT_GRAIN_DATETIME)
+    self.assertEqual((result.values[0].start, result.values[0].end), (timestamp(2024, 5, 2, 15), timestamp(2024, 5, 2, 17)))
+
+  def test_meridiem_borrowing(self):
+    cases = {
+      'tomorrow 3-5pm': ((2024, 5, 2, 15), (2024, 5, 2, 17)),
+      'tomorrow 11-1pm': ((2024, 5, 2, 11), (2024, 5, 2, 13)),
+      'tomorrow 10-2pm': ((2024, 5, 2, 10), (2024, 5, 2, 14)),
+      'tomorrow 9-11am': ((2024, 5, 2, 9), (2024, 5, 2, 11)),
+      'tomorrow 10am-2': ((2024, 5, 2, 10), (2024, 5, 2, 14)),
+      'tomorrow 11am-1': ((2024, 5, 2, 11), (2024, 5, 2, 13)),
+      'tomorrow 10pm-2am': ((2024, 5, 2, 22), (2024, 5, 3, 2)),
+    }
+    for (message, (start, end)) in cases.items():
+      with self.subTest(message=message):
+        (result,) = nlp.convert_doc(local_nlp._parse(message, REFERENCE_TIME), REFERENCE_TIME, nlp.ENT_GRAIN_DATETIME)
+        self.assertEqual((result.values[0].start, result.values[0].end), (timestamp(*start), timestamp(*end)))
+
+  def test_ambiguous_ranges_go_to_wit(self):
+    for message in ['tomorrow 3-5', 'tomorrow 13-5pm', 'at 9']:
+      with self.subTest(message=message):
+        self.assertIsNone(local_nlp._parse(message, REFERENCE_TIME))
+
+
+class WeekdayTest(unittest.TestCase):
+  def test_current_weekday_goes_to_wit(self):
+    for message in ['wednesday', 'wed at 9pm', 'on wednesday 3-5pm']:
+      with self.subTest(message=message):
+        self.assertIsNone(local_nlp._parse(message, REFERENCE_TIME))
+
+  def test_other_weekdays_are_upcoming(self):
+    doc = local_nlp._parse('thursday at 9pm', REFERENCE_TIME)
+    values = doc['entities'][local_nlp.ENT_DATETIME_KEY][0]['values']
+    self.assertEqual([int(datetime.datetime.fromisoformat(value['value']).timestamp()) for value in values], [timestamp(2024, 5, day, 21) for day in (2, 9, 16)])
+    (result,) = nlp.convert_doc(doc, REFERENCE_TIME, nlp.ENT_GRAIN_DATETIME)
+    self.assertEqual([value.start for value in result.values], [timestamp(2024, 5, 2, 21)])
+    (result,) = nlp.convert_doc(local_nlp._parse('tue', REFERENCE_TIME), REFERENCE_TIME, nlp.ENT_GRAIN_DATE)
+    self.assertEqual(result.values[0].start, timestamp(2024, 5, 7, 16, 20, 11))
+
+
+class StatsTest(unittest.TestCase):
+  def test_exported_as_metrics(self):
+    before = dict(local_nlp.stats)
+    for message in ['at 9pm', 'tomorrow', 'sometime around the solstice']:
+      local_nlp.parse(message, REFERENCE_TIME)
+    self.assertEqual(local_nlp.stats, {'local': before['local'] + 2, 'fallback': before['fallback'] + 1})
+    lines = metrics.render().splitlines()
+    self.assertIn(f'soupbot_local_nlp_parses_total{{result="local"}} {before["local"] + 2}', lines)
+    self.assertIn(f'soupbot_local_nlp_parses_total{{result="fallback"}} {before["fallback"] + 1}', lines)
+
+
+if __name__ == '__main__':
+  unittest.main()
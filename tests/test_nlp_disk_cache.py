@@ -0,0 +1,82 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import dateutil.tz
+
+import db_async
+import env
+import nlp
+from bench.fake_wit import FakeWitServer
+
+TZ = dateutil.tz.gettz('America/Sao_Paulo')
+# A Monday
+MONDAY = datetime.datetime(2024, 5, 6, 10, tzinfo=TZ)
+TUESDAY = MONDAY + datetime.timedelta(days=1)
+
+
+def first_value(doc: dict) -> datetime.datetime:
+  return datetime.datetime.fromisoformat(doc['entities'][nlp.ENT_DATETIME_KEY][0]['values'][0]['value'])
+
+
+class RelativeQueryTest(unittest.TestCase):
+  def test_relative_queries(self):
+    for query in ['tomorrow at 6pm', 'the day after tomorrow', 'tonight at 8', 'today 5pm', 'friday 3-5pm', 'sat at noon',
+        'next week', 'this weekend', 'in 2 hours', '30 minutes ago', 'now', 'next month', 'thursdays at 9']:
+      with self.subTest(query=query):
+        self.assertRegex(nlp.normalize_query(query), nlp._RELATIVE_RE)
+
+  def test_absolute_queries(self):
+    for query in ['may 3rd at 6pm', '2024-05-10', 'at 9pm', '9:30am', 'june 1 3-5pm', 'noon']:
+      with self.subTest(query=query):
+        self.assertNotRegex(nlp.normalize_query(query), nlp._RELATIVE_RE)
+
+
+class DiskCacheTest(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.fake_wit = FakeWitServer()
+    await self.fake_wit.start()
+    env.WIT_TOKEN = 'test'
+    env.WIT_URL = self.fake_wit.url
+    env.DB_PATH = os.path.join(self.tmp.name, 'test.db')
+    env.NLP_DISK_CACHE = True
+    db_async.init()
+    nlp.init()
+    await nlp.start()
+
+  async def asyncTearDown(self):
+    await nlp.close()
+    await db_async.close()
+    await self.fake_wit.close()
+    env.NLP_DISK_CACHE = False
+    self.tmp.cleanup()
+
+  async def fetch_after_restart(self, message: str, reference_time: datetime.datetime) -> dict:
+    # Only the disk cache survives a restart
+    nlp.doc_cache.clear()
+    return await nlp.fetch_doc(message, reference_time)
+
+  async def test_relative_day_rolls_over(self):
+    doc = await nlp.fetch_doc('tomorrow at 6pm', MONDAY)
+    self.assertEqual(first_value(doc), datetime.datetime(2024, 5, 7, 18, tzinfo=TZ))
+    doc = await self.fetch_after_restart('tomorrow at 6pm', TUESDAY)
+    self.assertEqual(first_value(doc), datetime.datetime(2024, 5, 8, 18, tzinfo=TZ))
+    self.assertEqual(self.fake_wit.requests, 2)
+
+  async def test_absolute_query_is_persisted(self):
+    doc = await nlp.fetch_doc('may 10 at 6pm', MONDAY)
+    doc = await self.fetch_after_restart('may 10 at 6pm', TUESDAY)
+    self.assertEqual(first_value(doc), datetime.datetime(2024, 5, 10, 18, tzinfo=TZ))
+    self.assertEqual(self.fake_wit.requests, 1)
+
+  async def test_persisted_query_expires(self):
+    await nlp.fetch_doc('at 9pm', MONDAY)
+    doc = await self.fetch_after_restart('at 9pm', TUESDAY)
+    self.assertEqual(first_value(doc), datetime.datetime(2024, 5, 7, 21, tzinfo=TZ))
+    self.assertEqual(self.fake_wit.requests, 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
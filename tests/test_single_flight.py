@@ -0,0 +1,100 @@
+import asyncio
+import datetime
+import os
+import tempfile
+import time
+import unittest
+
+import cache
+import db_async
+import env
+import nlp
+from bench.fake_wit import FakeWitServer
+
+REFERENCE_TIME = datetime.datetime(2024, 5, 6, 10, tzinfo=datetime.timezone.utc)
+
+
+class SingleFlightTest(unittest.IsolatedAsyncioTestCase):
+  async def test_coalesces_concurrent_calls(self):
+    in_flight = cache.SingleFlight()
+    calls = 0
+
+    async def fn():
+      nonlocal calls
+      calls += 1
+      await asyncio.sleep(0.01)
+      return calls
+
+    self.assertEqual(await asyncio.gather(*(in_flight.do('key', fn) for _ in range(5))), [1] * 5)
+    self.assertEqual(in_flight.stats, {'calls': 1, 'coalesced': 4, 'cancelled': 0})
+    self.assertEqual(len(in_flight), 0)
+
+  async def test_cancels_call_when_every_waiter_is_cancelled(self):
+    in_flight = cache.SingleFlight()
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def fn():
+      started.set()
+      try:
+        await asyncio.sleep(10)
+      except asyncio.CancelledError:
+        cancelled.set()
+        raise
+
+    waiters = [asyncio.ensure_future(in_flight.do('key', fn)) for _ in range(2)]
+    await started.wait()
+    # Another waiter still needs the result
+    waiters[0].cancel()
+    await asyncio.sleep(0.01)
+    self.assertFalse(cancelled.is_set())
+    self.assertEqual(len(in_flight), 1)
+    # The last one gave up too
+    waiters[1].cancel()
+    await asyncio.sleep(0.01)
+    self.assertTrue(cancelled.is_set())
+    self.assertEqual(len(in_flight), 0)
+    self.assertEqual(in_flight.stats['cancelled'], 1)
+
+    # A new call for the same key starts afresh
+    async def ok():
+      return 'ok'
+    self.assertEqual(await in_flight.do('key', ok), 'ok')
+
+
+class CancelledParseTest(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.fake_wit = FakeWitServer(latency=0.3)
+    await self.fake_wit.start()
+    env.WIT_TOKEN = 'test'
+    env.WIT_URL = self.fake_wit.url
+    env.DB_PATH = os.path.join(self.tmp.name, 'test.db')
+    env.WIT_MAX_CONCURRENCY = 1
+    db_async.init()
+    nlp.init()
+    await nlp.start()
+
+  async def asyncTearDown(self):
+    await nlp.close()
+    await db_async.close()
+    await self.fake_wit.close()
+    env.WIT_MAX_CONCURRENCY = 10
+    self.tmp.cleanup()
+
+  async def test_losing_parse_releases_its_wit_slot(self):
+    # Like a candidate message in $available that loses to a higher priority one
+    loser = asyncio.ensure_future(nlp.fetch_doc('lets meet up sometime', REFERENCE_TIME))
+    await asyncio.sleep(0.05)
+    self.assertTrue(nlp.wit.semaphore.locked())
+    loser.cancel()
+    await asyncio.sleep(0.01)
+    self.assertFalse(nlp.wit.semaphore.locked())
+    # The only slot is free right away, instead of after the losing request completes
+    t0 = time.perf_counter()
+    self.assertIn('entities', await nlp.fetch_doc('some other time', REFERENCE_TIME))
+    self.assertLess(time.perf_counter() - t0, 0.45)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,155 @@
+import asyncio
+import datetime
+import time
+import unittest
+
+import breaker
+import nlp
+from bench.fake_wit import FakeWitServer
+
+REFERENCE_TIME = datetime.datetime(2024, 5, 6, 10, tzinfo=datetime.timezone.utc)
+
+
+class WitResilienceTest(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.fake_wit = FakeWitServer()
+    await self.fake_wit.start()
+    self.wit = None
+
+  async def asyncTearDown(self):
+    if self.wit:
+      await self.wit.close()
+    await self.fake_wit.close()
+
+  async def open_wit(self, **kwargs) -> nlp.Wit:
+    options = {'max_retries': 2, 'retry_base_delay': 0.01, 'max_retry_delay': 1, 'breaker_threshold': 100, 'breaker_reset_timeout': 0.2}
+    options.update(kwargs)
+    self.wit = nlp.Wit('test', url=self.fake_wit.url, **options)
+    await self.wit.open()
+    return self.wit
+
+  async def test_retries_after_429_honoring_retry_after(self):
+    wit = await self.open_wit()
+    self.fake_wit.fail_next(1, status=429, retry_after=0.2)
+    t0 = time.perf_counter()
+    with self.assertLogs('soupbot.nlp', 'WARNING'):
+      doc = await wit.message('at 9pm', REFERENCE_TIME)
+    self.assertGreaterEqual(time.perf_counter() - t0, 0.2)
+    self.assertIn('entities', doc)
+    self.assertEqual(self.fake_wit.requests, 2)
+    self.assertEqual(wit.stats['retries'], 1)
+
+  async def test_gives_up_when_retry_after_is_too_long(self):
+    wit = await self.open_wit(max_retry_delay=0.5)
+    self.fake_wit.fail_next(1, status=429, retry_after=60)
+    with self.assertRaises(nlp.WitRetryableError) as cm:
+      await wit.message('at 9pm', REFERENCE_TIME)
+    self.assertEqual(cm.exception.status, 429)
+    self.assertEqual(cm.exception.retry_after, 60)
+    self.assertEqual(self.fake_wit.requests, 1)
+
+  async def test_retries_5xx_until_exhausted(self):
+    wit = await self.open_wit(max_retries=2)
+    self.fake_wit.fail_next(3, status=503)
+    with self.assertRaises(nlp.WitRetryableError) as cm, self.assertLogs('soupbot.nlp', 'WARNING') as logs:
+      await wit.message('at 9pm', REFERENCE_TIME)
+    self.assertEqual(len(logs.records), 2)
+    self.assertEqual(cm.exception.status, 503)
+    self.assertEqual(self.fake_wit.requests, 3)
+    self.assertEqual(wit.stats['retries'], 2)
+    self.assertEqual(wit.stats['failures'], 3)
+
+  async def test_does_not_retry_other_errors(self):
+    wit = await self.open_wit()
+    self.fake_wit.fail_next(1, status=400)
+    with self.assertRaises(ValueError) as cm:
+      await wit.message('at 9pm', REFERENCE_TIME)
+    self.assertNotIsInstance(cm.exception, nlp.WitRetryableError)
+    self.assertEqual(self.fake_wit.requests, 1)
+
+  async def test_queue_timeout(self):
+    # Each request takes 0.3s and only one runs at a time, so the third one waits more than the 0.4s timeout
+    self.fake_wit.latency = 0.3
+    wit = await self.open_wit(max_concurrency=1, timeout=0.4, max_retries=0)
+    results = await asyncio.gather(*(wit.message('at 9pm', REFERENCE_TIME) for _ in range(3)), return_exceptions=True)
+    self.assertEqual(sum(isinstance(result, nlp.WitUnavailableError) for result in results), 1)
+    self.assertEqual(sum(isinstance(result, dict) for result in results), 2)
+    self.assertEqual(wit.stats['queue_timeouts'], 1)
+    self.assertEqual(self.fake_wit.requests, 2)
+
+  async def test_circuit_breaker(self):
+    wit = await self.open_wit(max_retries=0, breaker_threshold=2, breaker_reset_timeout=0.2)
+    self.fake_wit.fail_next(2, status=503)
+    for _ in range(2):
+      with self.assertRaises(nlp.WitRetryableError):
+        await wit.message('at 9pm', REFERENCE_TIME)
+    self.assertEqual(wit.breaker.state, breaker.OPEN)
+    # Open: fails fast without contacting Wit
+    with self.assertRaises(nlp.WitUnavailableError):
+      await wit.message('at 9pm', REFERENCE_TIME)
+    self.assertEqual(self.fake_wit.requests, 2)
+
+    # Half-open: a failed trial opens the breaker again
+    await asyncio.sleep(0.25)
+    self.fake_wit.fail_next(1, status=503)
+    with self.assertRaises(nlp.WitRetryableError):
+      await wit.message('at 9pm', REFERENCE_TIME)
+    self.assertEqual(wit.breaker.state, breaker.OPEN)
+    self.assertEqual(self.fake_wit.requests, 3)
+
+    # Half-open: a successful trial closes it
+    await asyncio.sleep(0.25)
+    self.assertIn('entities', await wit.message('at 9pm', REFERENCE_TIME))
+    self.assertEqual(wit.breaker.state, breaker.CLOSED)
+    self.assertIn('entities', await wit.message('at 9pm', REFERENCE_TIME))
+    self.assertEqual(self.fake_wit.requests, 5)
+    self.assertEqual(wit.breaker.stats['opened'], 2)
+
+  async def test_breaker_counts_requests_not_attempts(self):
+    wit = await self.open_wit(max_retries=2, breaker_threshold=3)
+    # Each request fails three times, retries included, but only counts once towards the threshold
+    for _ in range(2):
+      self.fake_wit.fail_next(3, status=503)
+      with self.assertRaises(nlp.WitRetryableError), self.assertLogs('soupbot.nlp', 'WARNING'):
+        await wit.message('at 9pm', REFERENCE_TIME)
+    self.assertEqual(wit.breaker.state, breaker.CLOSED)
+    self.assertEqual(wit.breaker.failures, 2)
+    self.fake_wit.fail_next(3, status=503)
+    with self.assertRaises(nlp.WitRetryableError), self.assertLogs('soupbot.nlp', 'WARNING'):
+      await wit.message('at 9pm', REFERENCE_TIME)
+    self.assertEqual(wit.breaker.state, breaker.OPEN)
+    self.assertEqual(self.fake_wit.requests, 9)
+
+  async def open_breaker(self, **kwargs) -> nlp.Wit:
+    wit = await self.open_wit(max_retries=0, breaker_threshold=1, breaker_reset_timeout=0.2, **kwargs)
+    self.fake_wit.fail_next(1, status=503)
+    with self.assertRaises(nlp.WitRetryableError):
+      await wit.message('at 9pm', REFERENCE_TIME)
+    self.assertEqual(wit.breaker.state, breaker.OPEN)
+    await asyncio.sleep(0.25)
+    return wit
+
+  async def test_half_open_trial_with_rejected_request(self):
+    wit = await self.open_breaker()
+    # Wit answered, so the breaker closes even though the request was rejected
+    self.fake_wit.fail_next(1, status=400)
+    with self.assertRaises(ValueError):
+      await wit.message('at 9pm', REFERENCE_TIME)
+    self.assertEqual(wit.breaker.state, breaker.CLOSED)
+    self.assertIn('entities', await wit.message('at 9pm', REFERENCE_TIME))
+
+  async def test_half_open_trial_with_queue_timeout(self):
+    wit = await self.open_breaker(max_concurrency=1, timeout=0.1)
+    # The trial times out waiting for a slot, without reaching Wit
+    await wit.semaphore.acquire()
+    with self.assertRaises(nlp.WitUnavailableError):
+      await wit.message('at 9pm', REFERENCE_TIME)
+    wit.semaphore.release()
+    self.assertEqual(self.fake_wit.requests, 1)
+    # The next call gets to be the trial right away, instead of waiting for another reset_timeout
+    self.assertIn('entities', await wit.message('at 9pm', REFERENCE_TIME))
+    self.assertEqual(wit.breaker.state, breaker.CLOSED)
+
+
+if __name__ == '__main__':
+  unittest.main()
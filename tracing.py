@@ -0,0 +1,125 @@
+import contextvars
+import cProfile
+import logging as pyLogging
+import os
+import time
+from typing import List, Optional, Tuple
+
+import env
+import metrics
+
+# Lightweight per-command tracing. A trace is started for each command, and span() records how long each stage of it took
+# (Wit requests, database calls, replies...). Stage durations are logged for slow commands and exported as metrics.
+# When tracing is disabled, or outside of a command, trace() and span() return a shared no-op context manager.
+
+logging = pyLogging.getLogger('soupbot.tracing')
+
+_current: contextvars.ContextVar[Optional['Trace']] = contextvars.ContextVar('soupbot_trace', default=None)
+_profiled_commands = 0
+_profiling = False
+
+
+class _NoopSpan:
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    return False
+
+_NOOP = _NoopSpan()
+
+
+class Trace:
+  __slots__ = ('command', 'spans', 'start', '_token')
+
+  def __init__(self, command: str):
+    self.command = command
+    # (stage, seconds)
+    self.spans: List[Tuple[str, float]] = []
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    self._token = _current.set(self)
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    elapsed = time.perf_counter() - self.start
+    _current.reset(self._token)
+    totals = {}
+    for (stage, seconds) in self.spans:
+      (total, count) = totals.get(stage, (0.0, 0))
+      totals[stage] = (total + seconds, count + 1)
+    for (stage, (total, _)) in totals.items():
+      metrics.record_stage(self.command, stage, total)
+    if elapsed * 1000 >= env.TRACE_SLOW_MS:
+      stages = ', '.join(f'{stage} {total * 1000:.1f}ms' + (f' (x{count})' if count > 1 else '') for (stage, (total, count)) in totals.items())
+      logging.info('%s took %.1fms: %s', self.command, elapsed * 1000, stages or 'no stages recorded')
+    return False
+
+
+class Span:
+  __slots__ = ('trace', 'stage', 'start')
+
+  def __init__(self, trace: Trace, stage: str):
+    self.trace = trace
+    self.stage = stage
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    self.trace.spans.append((self.stage, time.perf_counter() - self.start))
+    return False
+
+
+def trace(command: str):
+  if not env.TRACE:
+    return _NOOP
+  return Trace(command)
+
+def span(stage: str):
+  current = _current.get()
+  if current is None:
+    return _NOOP
+  return Span(current, stage)
+
+
+class _Profile:
+  __slots__ = ('command', 'profile')
+
+  def __init__(self, command: str):
+    self.command = command
+    self.profile = cProfile.Profile()
+
+  def __enter__(self):
+    global _profiling
+    _profiling = True
+    self.profile.enable()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    global _profiling
+    self.profile.disable()
+    _profiling = False
+    path = os.path.join(env.PROFILE_DIR, f'{self.command.lstrip("$")}-{time.strftime("%Y%m%d-%H%M%S")}-{_profiled_commands}.pstats')
+    try:
+      os.makedirs(env.PROFILE_DIR, exist_ok=True)
+      self.profile.dump_stats(path)
+      logging.info('Saved profile for %s to %s', self.command, path)
+    except OSError as e:
+      logging.warning('Failed to save profile for %s: %s', self.command, e)
+    return False
+
+# Profiles 1 in every env.PROFILE_SAMPLE_RATE commands. The profiler sees everything the event loop runs while the command
+# is in progress, including other commands; only one command is profiled at a time.
+def profile(command: str):
+  global _profiled_commands
+  if env.PROFILE_SAMPLE_RATE <= 0:
+    return _NOOP
+  _profiled_commands += 1
+  if _profiling or _profiled_commands % env.PROFILE_SAMPLE_RATE:
+    return _NOOP
+  return _Profile(command)
@@ -1,14 +1,28 @@
 import datetime
+import functools
+import os
+import resource
 from typing import List, Tuple, Union, Optional
 
+import dateutil.tz
+
 def datetime_to_timestamp(dt: datetime.datetime):
   return int(dt.timestamp())
 
-def rank_dinkdonks(dd_list: List[Tuple[str, int]], cut_off_at_length: Optional[int]=None, cut_off_at_user_id: Union[str, int, None]=None) -> List[Tuple[int, List[str]]]:
+# Interned tzinfo objects by zone name, so that resolving a user's timezone doesn't hit the zoneinfo files again.
+# Bounded, since $settimezone also looks up arbitrary user input (unknown names are cached as None).
+@functools.lru_cache(maxsize=1024)
+def get_tz(name: Optional[str]) -> Optional[datetime.tzinfo]:
+  if not name:
+    return None
+  return dateutil.tz.gettz(name)
+
+# The original leaderboard ranking. The bot uses leaderboard.ServerLeaderboard now, and its tests check it against this.
+def rank_dinkdonks(dd_list: List[Tuple[int, int]], cut_off_at_length: Optional[int]=None, cut_off_at_user_id: Union[str, int, None]=None) -> List[Tuple[int, List[int]]]:
   if len(dd_list) == 0:
     return []
-  if type(cut_off_at_user_id) is int:
-    cut_off_at_user_id = str(cut_off_at_user_id)
+  if type(cut_off_at_user_id) is str:
+    cut_off_at_user_id = int(cut_off_at_user_id)
   dd_list = sorted(dd_list, key=lambda v: v[1], reverse=True)
   current_users = [dd_list[0][0]]
   current_score = dd_list[0][1]
@@ -40,3 +54,11 @@ def get_ordinal(number: int):
   if lastdigit == 3:
     return f'{number}rd'
   return f'{number}th'
+
+# Current resident set size of this process, in bytes (or the peak RSS where /proc isn't available)
+def get_rss_bytes() -> int:
+  try:
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except (OSError, ValueError, IndexError):
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024